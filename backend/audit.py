@@ -0,0 +1,310 @@
+"""
+Group-Commit Audit Log Writer (HIPAA Audit Trail).
+
+Request handlers only append the event to an in-memory queue. A background
+thread flushes queued events in ONE `executemany` transaction, either every
+`flush_interval_ms` or as soon as `batch_size` events are waiting, so N
+concurrent requests share a single commit instead of paying for N.
+
+Durability modes (SENTRIA_AUDIT_MODE):
+- "strict" (default): `record()` returns only after the event has
+  committed. When the writer is idle the caller commits inline (no hand-off
+  latency); under load, events queue up and concurrent requests share one
+  commit. An event not committed within AUDIT_STRICT_TIMEOUT_S raises
+  AuditTimeout, so the request is never acknowledged without its audit row.
+  Sharing commits only pays off when each commit fsyncs (synchronous=FULL,
+  the default). Under synchronous=NORMAL a commit is cheap and strict mode
+  simply commits every request inline, like a direct INSERT would.
+- "async": `record()` returns immediately; events reach disk within one flush
+  interval. A crash can lose at most that window.
+
+Events are never dropped: a full queue blocks the caller until the writer
+catches up, a failed flush is retried, and `stop()` drains everything that
+is still queued. Each event keeps its own timestamp (taken at enqueue time),
+so batching does not change what lands in the ledger.
+"""
+import atexit
+import collections
+import os
+import threading
+import time
+
+AUDIT_MODE = os.getenv("SENTRIA_AUDIT_MODE", "strict").lower()
+AUDIT_FLUSH_INTERVAL_MS = float(os.getenv("SENTRIA_AUDIT_FLUSH_INTERVAL_MS", "5"))
+AUDIT_BATCH_SIZE = int(os.getenv("SENTRIA_AUDIT_BATCH_SIZE", "256"))
+AUDIT_MAX_QUEUE = int(os.getenv("SENTRIA_AUDIT_MAX_QUEUE", "10000"))
+AUDIT_STRICT_TIMEOUT_S = float(os.getenv("SENTRIA_AUDIT_STRICT_TIMEOUT_S", "10"))
+AUDIT_RETRY_SECONDS = 0.5
+
+INSERT_SQL = 'INSERT INTO audit_log (timestamp, user_ip, action, resource, status) VALUES (?, ?, ?, ?, ?)'
+
+class AuditTimeout(RuntimeError):
+    """
+    Strict mode: the event was not committed in time. It stays queued (and
+    is retried), but the request must not be acknowledged as audited.
+    """
+
+class AuditWriter:
+    """
+    Background group-commit writer for the audit_log table.
+    """
+
+    def __init__(self, pool, mode=AUDIT_MODE, flush_interval_ms=AUDIT_FLUSH_INTERVAL_MS,
+                 batch_size=AUDIT_BATCH_SIZE, max_queue=AUDIT_MAX_QUEUE):
+        if mode not in ("strict", "async"):
+            raise ValueError(f"Unknown audit mode: {mode!r} (expected 'strict' or 'async')")
+        self.pool = pool
+        self.strict = mode == "strict"
+        # Strict mode only queues behind other commits when commits fsync
+        self.group_strict = self.strict and getattr(pool, "synchronous", "FULL") in ("FULL", "EXTRA", "2", "3")
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch_size = max(1, int(batch_size))
+        self.max_queue = max(self.batch_size, int(max_queue))
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._flushing = False  # a commit (writer batch or inline) is in progress
+        self._last_timestamp = (None, "")
+        self._waiters = 0
+
+        # Sequence numbers: an event is durable once flushed_seq >= its seq
+        self._enqueued_seq = 0
+        self._flushed_seq = 0
+
+        # Metrics
+        self.batches = 0
+        self.events_flushed = 0
+        self.flush_failures = 0
+        self.max_queue_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self.blocked_enqueues = 0
+        self.inline_commits = 0
+
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        # The writer thread is per process: a pre-forked worker starts its own
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        with self._cond:
+            if self._pid == pid and self._thread is not None:
+                return
+            self._pid = pid
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="sentria-audit-writer", daemon=True)
+            self._thread.start()
+
+    def _timestamp(self):
+        # Same format as CURRENT_TIMESTAMP; formatted once per second, not per event
+        now = int(time.time())
+        cached = self._last_timestamp
+        if cached[0] != now:
+            cached = self._last_timestamp = (now, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now)))
+        return cached[1]
+
+    def start(self):
+        self._ensure_started()
+
+    def record(self, ip, action, resource, status):
+        """
+        Queues one audit event. In strict mode, blocks until it is committed
+        (raises AuditTimeout if that takes longer than AUDIT_STRICT_TIMEOUT_S).
+        """
+        self.record_many(ip, [(action, resource, status)])
+
+    def record_many(self, ip, events):
+        """
+        Queues a batch of (action, resource, status) events from one request
+        together, so they land in the same flush. Strict mode waits once for all.
+        """
+        if not events:
+            return
+        self._ensure_started()
+        timestamp = self._timestamp()
+        rows = [(timestamp, ip, action, resource, status) for action, resource, status in events]
+
+        if self.strict and not self.group_strict and not self._stopping:
+            # No group commit (commits don't fsync): commit right here, no queue and no lock
+            if self._flush(rows, inline=True):
+                return
+            with self._cond:
+                seq = self._enqueue(rows)  # the writer retries it
+            self._wait_flushed(seq, len(rows))
+            return
+
+        with self._cond:
+            # Backpressure instead of dropping events
+            while len(self._queue) + len(rows) > self.max_queue and self._queue and not self._stopping:
+                self.blocked_enqueues += 1
+                self._cond.notify_all()
+                self._cond.wait()
+
+            # Strict + idle (nothing queued or being committed): commit inline on
+            # this thread instead of handing off to the writer. Nothing older is
+            # pending, so inline rows never enter the queue's sequence.
+            inline = self.strict and not self._stopping and not self._queue and not self._flushing
+            if inline:
+                self._flushing = True  # the writer waits for us
+            else:
+                was_empty = not self._queue
+                seq = self._enqueue(rows)
+                if not self.strict:
+                    if was_empty or len(self._queue) >= self.batch_size:
+                        self._cond.notify_all()
+                    return
+
+        if inline:
+            committed = self._flush(rows, inline=True)
+            with self._cond:
+                self._flushing = False
+                self._cond.notify_all()
+                if committed:
+                    return
+                seq = self._enqueue(rows)  # the writer retries it
+
+        self._wait_flushed(seq, len(rows))
+
+    def _enqueue(self, rows):
+        # Caller holds self._cond. Returns the sequence number of the last row.
+        self._queue.extend(rows)
+        self._enqueued_seq += len(rows)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        return self._enqueued_seq
+
+    def _wait_flushed(self, seq, count):
+        with self._cond:
+            # Wake the writer right away; whoever else is queued rides along
+            self._waiters += 1
+            self._cond.notify_all()
+            deadline = time.monotonic() + AUDIT_STRICT_TIMEOUT_S
+            try:
+                while self._flushed_seq < seq:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        # Still queued (and retried), but the caller must not report success
+                        raise AuditTimeout(f"{count} audit event(s) not committed within {AUDIT_STRICT_TIMEOUT_S}s")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # An inline commit must finish first (flushed_seq moves in order)
+                while self._flushing or (not self._queue and not self._stopping):
+                    self._cond.wait()
+                # Async mode: let a batch build up for one interval unless it is
+                # already full, someone is waiting on it, or we are shutting down
+                if (self._queue and not self.strict and not self._stopping
+                        and len(self._queue) < self.batch_size and not self._waiters):
+                    self._cond.wait(self.flush_interval)
+
+                if not self._queue:
+                    if self._stopping:
+                        return
+                    continue
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size))]
+                last_seq = self._flushed_seq + len(batch)
+                self._flushing = True
+                # Free queue slots for blocked producers
+                self._cond.notify_all()
+
+            if self._flush(batch):
+                with self._cond:
+                    self._flushing = False
+                    self._flushed_seq = last_seq
+                    self._cond.notify_all()
+            else:
+                # Put the batch back in front and retry: audit events are never dropped
+                with self._cond:
+                    self._flushing = False
+                    self._queue.extendleft(reversed(batch))
+                    self._cond.notify_all()
+                time.sleep(AUDIT_RETRY_SECONDS)
+
+    def _flush(self, batch, inline=False):
+        start = time.perf_counter()
+        try:
+            with self.pool.transaction() as conn:
+                if len(batch) == 1:
+                    conn.execute(INSERT_SQL, batch[0])
+                else:
+                    conn.executemany(INSERT_SQL, batch)
+        except Exception as e:
+            with self._stats_lock:
+                self.flush_failures += 1
+            print(f"⚠️ Audit Log Flush Failed ({len(batch)} events queued for retry): {e}")
+            return False
+
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        # Inline commits can run on many threads at once
+        with self._stats_lock:
+            self.batches += 1
+            self.inline_commits += inline
+            self.events_flushed += len(batch)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything queued so far is committed. Returns False on timeout.
+        """
+        with self._cond:
+            target = self._enqueued_seq
+            if self._flushed_seq >= target:
+                return True
+        self._ensure_started()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._flushed_seq < target:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+        return True
+
+    def stop(self, timeout=30.0):
+        """
+        Drains every queued event to disk, then stops the writer thread.
+        """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        thread.join(timeout)
+        if thread.is_alive():
+            print(f"⚠️ Audit writer did not drain within {timeout}s ({len(self._queue)} events pending)")
+        else:
+            self._thread = None
+
+    def stats(self):
+        return {
+            "mode": "strict" if self.strict else "async",
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "inline_commits": self.inline_commits,
+            "events_flushed": self.events_flushed,
+            "avg_batch_size": self.events_flushed / self.batches if self.batches else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+            "avg_flush_ms": self._total_flush_ms / self.batches if self.batches else 0.0,
+            "max_flush_ms": self.max_flush_ms,
+            "flush_failures": self.flush_failures,
+            "blocked_enqueues": self.blocked_enqueues,
+        }
@@ -0,0 +1,264 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class InferenceOverloaded(Exception):
+    """
+    Raised when the inference queue is full. Endpoints map it to 503 + Retry-After.
+    """
+
+
+class BoundedExecutor:
+    """
+    Size-bounded worker pool for CPU-heavy inference work.
+
+    Keeps NumPy/torch work off the event loop so /health, /memory/* and
+    /logistics/* stay responsive. At most `max_pending` jobs may be running
+    or waiting; beyond that `run()` fails fast with InferenceOverloaded
+    (or, with block=True, waits for a free slot).
+    """
+
+    def __init__(self, max_workers=2, max_pending=8):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(self.max_workers, int(max_pending))
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        self._slots = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_pending
+
+    async def run(self, fn, *args, block=False):
+        # The slot semaphore is created lazily so it binds to the serving loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if not block and self._slots.locked():
+            self.rejected += 1
+            raise InferenceOverloaded(f"Inference queue full ({self.max_pending} pending)")
+
+        async with self._slots:
+            self.pending += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+            finally:
+                self.pending -= 1
+                self.completed += 1
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+class InferenceBatcher:
+    """
+    Dynamic Micro-Batching for single-patient inference.
+
+    Concurrent /predict calls each submit one feature row. A background worker
+    collects rows from an async queue until either `max_batch_size` rows are
+    waiting or `max_wait_ms` has elapsed since the first row arrived, runs ONE
+    batched forward pass, then splits the results back out to the callers.
+
+    `infer_fn` receives a float32 matrix of shape (N, input_size) and must
+    return a tuple of arrays, each with N rows (e.g. class_idx, confidence, qty).
+
+    With an `executor`, batches run on its worker pool instead of the event
+    loop. Only one batch per worker is in flight; while the workers are busy,
+    rows keep queueing (so batches grow under load) up to `max_queue_depth`,
+    after which submit() fails fast with InferenceOverloaded.
+    """
+
+    def __init__(self, infer_fn, max_batch_size=32, max_wait_ms=2.0, executor=None, max_queue_depth=0):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.executor = executor
+        self.max_queue_depth_limit = int(max_queue_depth)  # 0 = unbounded
+        self.queue = None
+        self._worker = None
+        self._inflight = None
+        self._dispatches = set()  # strong refs: the loop only keeps weak ones to tasks
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.total_requests = 0
+        self.rejected = 0
+        self.total_batches = 0
+        self.total_rows = 0
+        self.max_batch_seen = 0
+        self.max_queue_depth = 0
+        self.total_queue_wait = 0.0
+        self.total_forward_time = 0.0
+        self.batch_size_histogram = {}
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self.queue = asyncio.Queue()
+        self._inflight = asyncio.Semaphore(self.executor.max_workers if self.executor else 1)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=30.0):
+        """
+        Stops collecting, lets in-flight batches finish (up to `timeout`), and
+        fails everything else so no caller is left waiting forever.
+        """
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        # In-flight batches: wait for their results, cancel the stragglers
+        if self._dispatches:
+            _, pending = await asyncio.wait(set(self._dispatches), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        # Fail anything still waiting so callers don't hang forever
+        while not self.queue.empty():
+            _, future, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference batcher stopped"))
+
+    async def submit(self, features):
+        """
+        Queues one feature row and waits for its slice of the batched result.
+        """
+        if self._worker is None:
+            raise RuntimeError("Inference batcher is not running")
+        if self.max_queue_depth_limit and self.queue.qsize() >= self.max_queue_depth_limit:
+            self.rejected += 1
+            raise InferenceOverloaded(f"Inference queue full ({self.max_queue_depth_limit} waiting)")
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((features, future, time.perf_counter()))
+        self.total_requests += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return await future
+
+    async def _collect(self, batch):
+        # Block until at least one request is waiting, then fill the batch
+        batch.append(await self.queue.get())
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued without yielding
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        while True:
+            # Wait for a free worker BEFORE collecting, so rows pile up into
+            # bigger batches while every worker is busy
+            await self._inflight.acquire()
+            batch = []
+            try:
+                await self._collect(batch)
+            except BaseException:
+                self._inflight.release()
+                # Cancelled mid-collection (stop): these rows already left the queue
+                self._fail(batch, RuntimeError("Inference batcher stopped"))
+                raise
+
+            if self.executor is None:
+                try:
+                    self._complete(batch, *self._forward(batch))
+                finally:
+                    self._inflight.release()
+            else:
+                task = asyncio.create_task(self._dispatch(batch))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+
+    def _forward(self, batch):
+        started = time.perf_counter()
+        try:
+            inputs = np.stack([features for features, _, _ in batch]).astype(np.float32, copy=False)
+            return started, self.infer_fn(inputs), None
+        except Exception as e:
+            return started, None, e
+
+    async def _dispatch(self, batch):
+        try:
+            started, outputs, error = await self.executor.run(self._forward, batch, block=True)
+        except asyncio.CancelledError:
+            self._fail(batch, RuntimeError("Inference batcher stopped"))
+            raise
+        except Exception as e:
+            started, outputs, error = time.perf_counter(), None, e
+        finally:
+            self._inflight.release()
+        self._complete(batch, started, outputs, error)
+
+    def _fail(self, batch, error):
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _complete(self, batch, started, outputs, error):
+        if error is not None:
+            self._fail(batch, error)
+            return
+        finished = time.perf_counter()
+
+        for row, (_, future, enqueued) in enumerate(batch):
+            self.total_queue_wait += started - enqueued
+            if not future.done():
+                future.set_result(tuple(output[row] for output in outputs))
+
+        size = len(batch)
+        self.total_batches += 1
+        self.total_rows += size
+        self.total_forward_time += finished - started
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        self.batch_size_histogram[size] = self.batch_size_histogram.get(size, 0) + 1
+
+    def stats(self):
+        """
+        Tuning metrics: queue depth and the distribution of batch sizes.
+        """
+        batches = self.total_batches or 1
+        rows = self.total_rows or 1
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_limit": self.max_queue_depth_limit,
+            "total_requests": self.total_requests,
+            "rejected": self.rejected,
+            "total_batches": self.total_batches,
+            "avg_batch_size": self.total_rows / batches if self.total_batches else 0.0,
+            "max_batch_seen": self.max_batch_seen,
+            "avg_queue_wait_ms": 1000.0 * self.total_queue_wait / rows,
+            "avg_forward_ms": 1000.0 * self.total_forward_time / batches,
+            "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+        }
@@ -0,0 +1,610 @@
+"""
+Backend Performance Benchmarks.
+
+    python backend/benchmarks.py sqlite [--seconds 3] [--threads 8]
+    python backend/benchmarks.py audit [--seconds 3] [--threads 8]
+    python backend/benchmarks.py envelope
+    python backend/benchmarks.py logistics [--rows 1000000]
+    python backend/benchmarks.py orders [--rows 5000]
+    python backend/benchmarks.py ingest [--rows 200000]
+    python backend/benchmarks.py traincache [--rows 100000]
+    python backend/benchmarks.py featurize [--rows 400000] [--workers 1,2,4,8]
+    python backend/benchmarks.py train [--rows 100000]
+
+Each benchmark compares the previous code path against the current one on a
+throwaway database, so results are reproducible on any machine.
+"""
+import argparse
+import json
+import random
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from db import SQLitePool
+from audit import AuditWriter
+import envelope
+import ingest
+from logistics import LOGISTICS_INDEXES, insert_orders, page_shipments
+from changefeed import CHANGES_SCHEMA, ChangeFeed
+
+MEMORY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS memory (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+AUDIT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        user_ip TEXT, action TEXT, resource TEXT, status TEXT
+    )
+'''
+UPSERT = '''
+    INSERT INTO memory (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=CURRENT_TIMESTAMP
+'''
+AUDIT = 'INSERT INTO audit_log (user_ip, action, resource, status) VALUES (?, ?, ?, ?)'
+BLOB = "gAAAAA" + "x" * 400  # roughly a small encrypted session blob
+
+def run_threads(fn, threads, seconds):
+    """
+    Runs fn(thread_index, i) in a loop on N threads; returns completed calls/second.
+    """
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(t):
+        i = 0
+        while time.perf_counter() < deadline:
+            fn(t, i)
+            i += 1
+        counts[t] = i
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(counts) / seconds
+
+def bench_sqlite(args):
+    """
+    /memory/set and /memory/get database work (value + audit row per request):
+    connect-per-call with the default rollback journal vs. the pooled WAL layer.
+    """
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        results = {}
+        for mode in ("connect-per-call", "pooled-wal"):
+            path = os.path.join(workdir, f"{mode}.db")
+            setup = sqlite3.connect(path)
+            setup.execute(MEMORY_SCHEMA)
+            setup.execute(AUDIT_SCHEMA)
+            setup.executemany(UPSERT, [(f"key-{k}", BLOB) for k in range(1000)])
+            setup.commit()
+            setup.close()
+            pool = SQLitePool(path)
+
+            if mode == "connect-per-call":
+                def write(t, i):
+                    conn = sqlite3.connect(path, timeout=30)
+                    conn.execute(UPSERT, (f"key-{(t * 7919 + i) % 1000}", BLOB))
+                    conn.commit()
+                    conn.close()
+                    conn = sqlite3.connect(path, timeout=30)
+                    conn.execute(AUDIT, ("127.0.0.1", "WRITE", "key", "SUCCESS"))
+                    conn.commit()
+                    conn.close()
+
+                def read(t, i):
+                    conn = sqlite3.connect(path, timeout=30)
+                    conn.execute("SELECT value FROM memory WHERE key = ?", (f"key-{(t * 7919 + i) % 1000}",)).fetchone()
+                    conn.close()
+                    conn = sqlite3.connect(path, timeout=30)
+                    conn.execute(AUDIT, ("127.0.0.1", "READ", "key", "SUCCESS"))
+                    conn.commit()
+                    conn.close()
+            else:
+                def write(t, i):
+                    with pool.transaction() as conn:
+                        conn.execute(UPSERT, (f"key-{(t * 7919 + i) % 1000}", BLOB))
+                    with pool.transaction() as conn:
+                        conn.execute(AUDIT, ("127.0.0.1", "WRITE", "key", "SUCCESS"))
+
+                def read(t, i):
+                    pool.connection().execute("SELECT value FROM memory WHERE key = ?", (f"key-{(t * 7919 + i) % 1000}",)).fetchone()
+                    with pool.transaction() as conn:
+                        conn.execute(AUDIT, ("127.0.0.1", "READ", "key", "SUCCESS"))
+
+            results[mode] = {
+                "write": run_threads(write, args.threads, args.seconds),
+                "read": run_threads(read, args.threads, args.seconds),
+            }
+
+        print(f"--- SQLITE LAYER ({args.threads} threads, {args.seconds}s each) ---")
+        for workload in ("write", "read"):
+            before, after = results["connect-per-call"][workload], results["pooled-wal"][workload]
+            print(f"/memory/{'set' if workload == 'write' else 'get'} DB work: {before:,.0f} req/s -> {after:,.0f} req/s ({after / before:.2f}x)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_audit(args):
+    """
+    Audit events from concurrent request threads: one commit per event (the
+    previous log_audit) vs. the group-commit AuditWriter in strict and async mode.
+    """
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        results = {}
+        for mode in ("commit-per-event", "group-strict", "group-async"):
+            path = os.path.join(workdir, f"{mode}.db")
+            pool = SQLitePool(path)
+            with pool.transaction() as conn:
+                conn.execute(AUDIT_SCHEMA)
+
+            if mode == "commit-per-event":
+                def log(t, i):
+                    with pool.transaction() as conn:
+                        conn.execute(AUDIT, ("127.0.0.1", "READ", f"key-{i}", "SUCCESS"))
+                rate = run_threads(log, args.threads, args.seconds)
+            else:
+                writer = AuditWriter(pool, mode=mode.split("-")[1])
+                rate = run_threads(lambda t, i: writer.record("127.0.0.1", "READ", f"key-{i}", "SUCCESS"), args.threads, args.seconds)
+                writer.stop()
+                stats = writer.stats()
+                print(f"  {mode}: avg batch {stats['avg_batch_size']:.1f} events, avg flush {stats['avg_flush_ms']:.2f} ms, max queue {stats['max_queue_depth']}")
+
+            stored = pool.connection().execute("SELECT COUNT(*) FROM audit_log").fetchone()[0]
+            results[mode] = (rate, stored)
+            pool.close()
+
+        print(f"--- AUDIT LOG ({args.threads} threads, {args.seconds}s each) ---")
+        baseline = results["commit-per-event"][0]
+        for mode, (rate, stored) in results.items():
+            print(f"{mode}: {rate:,.0f} events/s ({rate / baseline:.2f}x), {stored:,} rows stored")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def sample_payloads():
+    """
+    Representative memory values: a small session, a shopping cart and a large session history.
+    """
+    rng = random.Random(7)
+    drugs = ["Metformin 500 Mg", "Lisinopril 10 Mg", "Atorvastatin 20 Mg", "Amoxicillin 250 Mg", "Insulin Glargine"]
+
+    def item(i):
+        return {"id": f"SKU-{rng.randint(10000, 99999)}", "name": rng.choice(drugs), "qty": rng.randint(1, 12),
+                "unit_price": round(rng.uniform(2, 400), 2), "cold_chain": rng.random() < 0.3, "line": i}
+
+    return {
+        "session (small)": {"user_id": "u-123", "theme": "dark", "last_view": "/inventory", "filters": {"status": "active"}},
+        "cart (50 items)": {"user_id": "u-123", "items": [item(i) for i in range(50)], "currency": "USD"},
+        "history (1000 events)": {"events": [{"ts": 1700000000 + i * 37, "action": rng.choice(["view", "order", "search"]),
+                                               "target": rng.choice(drugs), "page": f"/inventory/{i % 40}"} for i in range(1000)]},
+    }
+
+def bench_envelope(args):
+    """
+    Stored size and seal/unseal latency: legacy base64 Fernet TEXT vs. the
+    compressed binary envelope.
+    """
+    from cryptography.fernet import Fernet
+    cipher = Fernet(Fernet.generate_key())
+    iterations = 200
+
+    def per_call_us(fn):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    print("--- MEMORY VALUE ENVELOPE ---")
+    for name, value in sample_payloads().items():
+        legacy = cipher.encrypt(json.dumps(value).encode("utf-8")).decode("utf-8")
+        sealed = envelope.seal(cipher, value)
+        assert envelope.unseal(cipher, legacy) == envelope.unseal(cipher, sealed) == value
+
+        write_legacy = per_call_us(lambda: cipher.encrypt(json.dumps(value).encode("utf-8")).decode("utf-8"))
+        write_sealed = per_call_us(lambda: envelope.seal(cipher, value))
+        read_legacy = per_call_us(lambda: envelope.unseal(cipher, legacy))
+        read_sealed = per_call_us(lambda: envelope.unseal(cipher, sealed))
+        print(f"{name}: {len(json.dumps(value)):,} B JSON | stored {len(legacy):,} B -> {len(sealed):,} B "
+              f"({len(sealed) / len(legacy):.0%}) | write {write_legacy:,.0f} -> {write_sealed:,.0f} us "
+              f"| read {read_legacy:,.0f} -> {read_sealed:,.0f} us")
+
+SHIPMENTS_SCHEMA = '''
+    CREATE TABLE shipments (
+        id TEXT PRIMARY KEY, order_id TEXT, tracking_number TEXT, provider TEXT, status TEXT,
+        estimated_delivery TIMESTAMP, origin TEXT, destination TEXT, region TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+ORDERS_SCHEMA = '''
+    CREATE TABLE orders (
+        id TEXT PRIMARY KEY, user_id TEXT, total_amount REAL, status TEXT, items TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+PROVIDERS = ("ColdChainAES", "FedEx", "UPS", "DHL", "MedCourier")
+REGIONS = ("northeast", "southeast", "midwest", "southwest", "west", "northwest", "mountain", "pacific", "plains", "atlantic")
+
+def populate_shipments(conn, count):
+    """
+    Realistic mix: ~90% delivered, the rest scheduled / in transit.
+    """
+    rng = random.Random(42)
+    conn.execute(SHIPMENTS_SCHEMA)
+    conn.execute(ORDERS_SCHEMA)
+    chunk = 100000
+    for start in range(0, count, chunk):
+        orders, shipments = [], []
+        for n in range(start, min(start + chunk, count)):
+            roll = rng.random()
+            status = "delivered" if roll < 0.9 else ("in_transit" if roll < 0.97 else "scheduled")
+            orders.append((f"ORD-{n:08X}", f"user-{n % 50000}", 10.0, "processing", "[]"))
+            shipments.append((f"SHP-{n:08X}", f"ORD-{n:08X}", f"1Z{n:010X}", PROVIDERS[n % len(PROVIDERS)], status,
+                              "2026-01-01", "Central Hub", "User Location", REGIONS[rng.randrange(len(REGIONS))]))
+        conn.executemany("INSERT INTO orders (id, user_id, total_amount, status, items) VALUES (?, ?, ?, ?, ?)", orders)
+        conn.executemany("INSERT INTO shipments (id, order_id, tracking_number, provider, status, estimated_delivery, "
+                         "origin, destination, region) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", shipments)
+    conn.commit()
+
+def bench_logistics(args):
+    """
+    Logistics query latency on a large shipments table: the previous
+    unindexed queries (OFFSET paging) vs. the indexed keyset-paginated ones.
+    """
+    args.rows = args.rows or 1000000
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        conn = sqlite3.connect(os.path.join(workdir, "logistics.db"))
+        start = time.perf_counter()
+        populate_shipments(conn, args.rows)
+        print(f"--- LOGISTICS QUERIES ({args.rows:,} shipments, built in {time.perf_counter() - start:.1f}s) ---")
+        cursor = conn.cursor()
+        deep = args.rows // 20  # offset of a "deep" page
+
+        def ms(fn, repeat=5):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                best = min(best, time.perf_counter() - start)
+            return best * 1000.0
+
+        def deep_cursor(**filters):
+            # Walk to the deep page once (untimed); the timed part is fetching the page after it
+            token, seen = None, 0
+            while seen < deep:
+                items, token = page_shipments(cursor, after=token, limit=500, **filters)
+                seen += len(items)
+                if token is None:
+                    break
+            return token
+
+        tracking = f"1Z{(args.rows * 3 // 4):010X}"
+        order_id = f"ORD-{(args.rows * 3 // 4):08X}"
+        before = {
+            "tracking lookup": ms(lambda: cursor.execute("SELECT * FROM shipments WHERE tracking_number=?", (tracking,)).fetchall()),
+            "shipment by order_id": ms(lambda: cursor.execute("SELECT * FROM shipments WHERE order_id=?", (order_id,)).fetchall()),
+            "orders by user_id": ms(lambda: cursor.execute("SELECT * FROM orders WHERE user_id=?", ("user-123",)).fetchall()),
+            "network page 1 (provider+region)": ms(lambda: cursor.execute(
+                "SELECT * FROM shipments WHERE status != 'delivered' AND provider=? AND region=? LIMIT 50",
+                ("DHL", "west")).fetchall()),
+            f"network page @ {deep:,} (OFFSET)": ms(lambda: cursor.execute(
+                "SELECT * FROM shipments WHERE status != 'delivered' LIMIT 50 OFFSET ?", (deep,)).fetchall()),
+        }
+
+        start = time.perf_counter()
+        for statement in LOGISTICS_INDEXES:
+            cursor.execute(statement)
+        conn.commit()
+        print(f"indexes built in {time.perf_counter() - start:.1f}s")
+
+        token = deep_cursor()
+        after = {
+            "tracking lookup": ms(lambda: cursor.execute("SELECT * FROM shipments WHERE tracking_number=?", (tracking,)).fetchall()),
+            "shipment by order_id": ms(lambda: cursor.execute("SELECT * FROM shipments WHERE order_id=?", (order_id,)).fetchall()),
+            "orders by user_id": ms(lambda: cursor.execute("SELECT * FROM orders WHERE user_id=?", ("user-123",)).fetchall()),
+            "network page 1 (provider+region)": ms(lambda: page_shipments(cursor, provider="DHL", region="west", limit=50)),
+            f"network page @ {deep:,} (OFFSET)": ms(lambda: page_shipments(cursor, after=token, limit=50)),
+        }
+        for name in before:
+            label = name.replace("(OFFSET)", "(OFFSET -> cursor)")
+            print(f"{label}: {before[name]:.3f} ms -> {after[name]:.3f} ms ({before[name] / max(after[name], 1e-6):,.0f}x)")
+        conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_orders(args):
+    """
+    Order ingestion: one /logistics/order-style transaction + audit row per
+    order vs. the bulk path (one transaction, executemany, one audit row).
+    """
+    import datetime
+    import uuid
+
+    count = args.rows or 5000
+    orders = [{"user_id": f"user-{n % 500}", "items": [{"id": "SKU-1", "qty": 2}], "total": 42.0, "region": "west"}
+              for n in range(count)]
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        results = {}
+        for mode in ("single", "bulk"):
+            pool = SQLitePool(os.path.join(workdir, f"{mode}.db"))
+            with pool.transaction() as conn:
+                conn.execute(SHIPMENTS_SCHEMA)
+                conn.execute(ORDERS_SCHEMA)
+                conn.execute(CHANGES_SCHEMA)
+                conn.execute(AUDIT_SCHEMA)
+                for statement in LOGISTICS_INDEXES:
+                    conn.execute(statement)
+
+            start = time.perf_counter()
+            if mode == "single":
+                for order in orders:
+                    order_id = f"ORD-{uuid.uuid4().hex[:8].upper()}"
+                    shipment_id = f"SHP-{uuid.uuid4().hex[:8].upper()}"
+                    tracking_num = f"1Z{uuid.uuid4().hex[:10].upper()}"
+                    eta = datetime.datetime.now() + datetime.timedelta(days=1)
+                    with pool.transaction() as conn:
+                        conn.execute("INSERT INTO orders (id, user_id, total_amount, status, items) VALUES (?, ?, ?, ?, ?)",
+                                     (order_id, order["user_id"], order["total"], "processing", json.dumps(order["items"])))
+                        conn.execute("INSERT INTO shipments (id, order_id, tracking_number, provider, status, estimated_delivery, "
+                                     "origin, destination, region) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (shipment_id, order_id, tracking_num, "ColdChainAES", "scheduled", eta,
+                                      "Central Hub", "User Location", order["region"]))
+                        ChangeFeed.record(conn, shipment_id, "insert", {"id": shipment_id, "eta": eta})
+                    with pool.transaction() as conn:
+                        conn.execute(AUDIT, ("127.0.0.1", "ORDER", order_id, "CREATED"))
+            else:
+                with pool.transaction() as conn:
+                    created, changes = insert_orders(conn, orders)
+                    ChangeFeed.record_many(conn, changes)
+                with pool.transaction() as conn:
+                    conn.execute(AUDIT, ("127.0.0.1", "ORDER_BATCH", ",".join(r["order_id"] for r in created), "CREATED"))
+            elapsed = time.perf_counter() - start
+
+            stored = pool.connection().execute("SELECT COUNT(*) FROM shipments").fetchone()[0]
+            assert stored == count, (mode, stored)
+            results[mode] = count / elapsed
+            pool.close()
+
+        print(f"--- ORDER INGESTION ({count:,} orders) ---")
+        print(f"single-order path: {results['single']:,.0f} orders/s")
+        print(f"bulk path:         {results['bulk']:,.0f} orders/s ({results['bulk'] / results['single']:.1f}x)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def write_patient_archive(path, count, fmt="ndjson"):
+    """
+    Writes a gzip archive of synthetic patient records (the Box bundle's shape), streamed to disk.
+    """
+    import gzip
+    rng = random.Random(3)
+    diagnoses = ["Type 2 Diabetes", "Hypertension", "Asthma", "Metformin", "Chronic Kidney Disease", "Migraine"]
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        if fmt == "json":
+            f.write("[\n")
+        for n in range(count):
+            record = {"id": f"P{n:08d}", "age": rng.randint(1, 95), "gender": rng.choice(["female", "male"]),
+                      "diagnosis": rng.choice(diagnoses), "vitals": {"bp": [rng.randint(100, 160), rng.randint(60, 100)],
+                      "hr": rng.randint(50, 110)}, "notes": "x" * rng.randint(20, 200)}
+            line = json.dumps(record)
+            if fmt == "json":
+                f.write(line + (",\n" if n < count - 1 else "\n"))
+            else:
+                f.write(line + "\n")
+        if fmt == "json":
+            f.write("]\n")
+
+def bench_ingest(args):
+    """
+    Peak Python heap while loading a gzip archive: the previous
+    read -> gunzip -> decode -> json.loads path vs. streaming ingestion,
+    at two archive sizes (streaming should stay flat).
+    """
+    import gzip
+    import io
+    import tracemalloc
+
+    base = args.rows or 200000
+
+    def legacy(path):
+        with open(path, "rb") as f:
+            content = f.read()  # stands in for response.content
+        with gzip.GzipFile(fileobj=io.BytesIO(content), mode="rb") as f:
+            text_data = f.read().decode("utf-8")
+        try:
+            records = json.loads(text_data)
+        except json.JSONDecodeError:
+            records = [json.loads(line) for line in text_data.splitlines() if line.strip()]
+        return sum(1 for _ in records)
+
+    def streaming(path):
+        return sum(1 for _ in ingest.iter_local_records(path))
+
+    def measure(fn, path):
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = fn(path)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return count, peak / 1e6, elapsed
+
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        print("--- TRAINING DATA INGESTION (peak Python heap) ---")
+        for fmt in ("ndjson", "json"):
+            for count in (base // 4, base):
+                path = os.path.join(workdir, f"patients-{count}.{fmt}.gz")
+                write_patient_archive(path, count, fmt)
+                archive_mb = os.path.getsize(path) / 1e6
+                n_old, peak_old, t_old = measure(legacy, path)
+                n_new, peak_new, t_new = measure(streaming, path)
+                assert n_old == n_new == count, (n_old, n_new, count)
+                print(f"{fmt:6} {count:>8,} records ({archive_mb:.1f} MB gz): "
+                      f"peak {peak_old:,.1f} MB -> {peak_new:,.2f} MB | {t_old:.2f}s -> {t_new:.2f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_traincache(args):
+    """
+    Dataset construction from a local archive: first run (parse + featurize +
+    write cache) vs. a repeat run (hash + mmap) vs. no cache, plus one epoch
+    of data loading over the memory-mapped columns: per-item DataLoader
+    (collate) vs. batched index sampling (train.make_loader).
+    """
+    from torch.utils.data import DataLoader
+    import datacache
+    import train
+
+    rows = args.rows or 100000
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        archive = os.path.join(workdir, "patients.ndjson.gz")
+        write_patient_archive(archive, rows)
+        cache = datacache.TrainingDataCache(os.path.join(workdir, "cache"))
+
+        def build(cache):
+            start = time.perf_counter()
+            dataset = train.BoxClinicalDataset(num_samples=rows, source=archive, cache=cache)
+            return dataset, time.perf_counter() - start
+
+        _, t_plain = build(False)
+        _, t_cold = build(cache)
+        dataset, t_warm = build(cache)
+
+        def epoch(loader):
+            start = time.perf_counter()
+            for _ in loader:
+                pass
+            return time.perf_counter() - start
+
+        t_items = epoch(DataLoader(dataset, batch_size=64, shuffle=True))
+        t_batched = epoch(train.make_loader(dataset, batch_size=64, shuffle=True))
+
+        print(f"--- TRAINING DATA CACHE ({rows:,} records, {os.path.getsize(archive) / 1e6:.1f} MB gz) ---")
+        print(f"No cache:            {t_plain:.2f}s")
+        print(f"First run (+ write): {t_cold:.2f}s")
+        print(f"Repeat run (mmap):   {t_warm:.2f}s")
+        print(f"Epoch of batches (64): per-item DataLoader {t_items:.2f}s | batched sampling {t_batched:.2f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_featurize(args):
+    """
+    Parse + featurize throughput of featurize.featurize_batches by worker count.
+    """
+    import featurize
+
+    rows = args.rows or 400000
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        archive = os.path.join(workdir, "patients.ndjson.gz")
+        write_patient_archive(archive, rows)
+        print(f"--- PARALLEL FEATURIZATION ({rows:,} NDJSON records, {os.cpu_count()} CPUs) ---")
+        baseline = None
+        for workers in (int(n) for n in args.workers.split(",")):
+            batches = ingest.iter_local_batches(archive, featurize.FEATURIZE_CHUNK)
+            start = time.perf_counter()
+            (features, _, _), report = featurize.featurize_batches(batches, rows, workers=workers)
+            elapsed = time.perf_counter() - start
+            batches.close()
+            assert len(features) == rows and not report.errors
+            baseline = baseline or elapsed
+            print(f"{workers:>2} worker(s): {elapsed:6.2f}s | {rows / elapsed:>10,.0f} records/s | speedup {baseline / elapsed:.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_train(args):
+    """
+    One training epoch (CPU, batch 64): the previous loop (four .item()
+    syncs per step) vs. train.train_epoch in fp32 and with bf16 autocast.
+    """
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    import train
+    from model import ClinicalNetwork
+
+    rows = args.rows or 100000
+    workdir = tempfile.mkdtemp(prefix="sentria-bench-")
+    try:
+        archive = os.path.join(workdir, "patients.ndjson.gz")
+        write_patient_archive(archive, rows)
+        dataset = train.BoxClinicalDataset(num_samples=rows, source=archive, cache=False)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    device = torch.device("cpu")
+    loader = train.make_loader(dataset, batch_size=64, shuffle=True)
+    criterion_class, criterion_qty = nn.CrossEntropyLoss(), nn.MSELoss()
+
+    def setup():
+        torch.manual_seed(0)
+        model = ClinicalNetwork(10, 50).to(device)
+        model.train()
+        return model, optim.Adam(model.parameters(), lr=train.LEARNING_RATE)
+
+    def legacy_epoch(model, optimizer):
+        running_loss, correct, total = 0.0, 0, 0
+        start = time.perf_counter()
+        for inputs, target_class, target_qty in loader:
+            target_qty = target_qty.float().unsqueeze(1)
+            optimizer.zero_grad()
+            pred_class, pred_qty = model(inputs)
+            loss = criterion_class(pred_class, target_class) + 0.05 * criterion_qty(pred_qty, target_qty)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+            _, predicted = torch.max(pred_class.data, 1)
+            total += target_class.size(0)
+            correct += (predicted == target_class).sum().item()
+            _ = {'loss': loss.item(), 'acc': correct / total,
+                 'qty_err': torch.mean(torch.abs(pred_qty - target_qty)).item()}
+        return total / (time.perf_counter() - start)
+
+    results = {"per-step .item() (previous)": legacy_epoch(*setup())}
+    for label, bf16 in (("train_epoch fp32", False), ("train_epoch bf16 autocast", True)):
+        model, optimizer = setup()
+        results[label] = train.train_epoch(model, loader, optimizer, criterion_class, criterion_qty, device,
+                                           bf16=bf16, desc=label)["samples_per_s"]
+
+    print(f"--- TRAINING EPOCH ({rows:,} samples, batch 64, CPU, {torch.get_num_threads()} threads) ---")
+    for label, rate in results.items():
+        print(f"{label:28} {rate:>10,.0f} samples/s")
+
+BENCHMARKS = {
+    "sqlite": bench_sqlite,
+    "audit": bench_audit,
+    "envelope": bench_envelope,
+    "logistics": bench_logistics,
+    "orders": bench_orders,
+    "ingest": bench_ingest,
+    "traincache": bench_traincache,
+    "featurize": bench_featurize,
+    "train": bench_train,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Sentria backend benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", default="1,2,4,8", help="featurize: comma-separated worker counts")
+    parser.add_argument("--rows", type=int, default=None, help="table/batch size (default depends on the benchmark)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Shipment Change Feed (push updates for the network map).
+
+Write side: every shipment insert / status change appends a row to the
+`shipment_changes` table inside the SAME transaction as the change, so the
+feed can never disagree with the data. The row id is the feed's sequence
+number.
+
+Read side: ONE poller per process tails the table (woken immediately by
+local writes, otherwise every `poll_interval` for writes made by other
+workers) and fans each new batch out to every subscriber's queue. N
+connected maps cost one indexed query per change instead of N polling
+queries per interval.
+
+Subscribers resume from any sequence number (SSE `Last-Event-ID`). A
+subscriber that falls behind, or asks for a sequence that retention has
+already pruned, is replayed from the table or told to reload its snapshot.
+"""
+import asyncio
+import json
+import os
+import time
+
+CHANGEFEED_POLL_INTERVAL_S = float(os.getenv("SENTRIA_CHANGEFEED_POLL_INTERVAL_S", "0.5"))
+CHANGEFEED_RETENTION = int(os.getenv("SENTRIA_CHANGEFEED_RETENTION", "100000"))  # rows kept for resuming
+CHANGEFEED_QUEUE_SIZE = int(os.getenv("SENTRIA_CHANGEFEED_QUEUE_SIZE", "1000"))  # per subscriber
+CHANGEFEED_PAGE = 500
+
+CHANGES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS shipment_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        shipment_id TEXT,
+        op TEXT,      -- insert / status
+        data TEXT,    -- JSON: the new row (insert) or the changed fields (status)
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+class ChangeFeed:
+    """
+    Per-process broadcaster over the shipment_changes table.
+    """
+
+    def __init__(self, pool, poll_interval=CHANGEFEED_POLL_INTERVAL_S, retention=CHANGEFEED_RETENTION,
+                 queue_size=CHANGEFEED_QUEUE_SIZE):
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._wakeup = None
+        self._loop = None
+        self._task = None
+        self.last_seq = 0
+
+        # Metrics
+        self.polls = 0
+        self.published = 0
+        self.lagged = 0
+
+    # ---- write side (called inside the writer's transaction) ----
+
+    @staticmethod
+    def record(conn, shipment_id, op, data):
+        """
+        Appends a change in the caller's transaction. Returns its sequence number.
+        """
+        cursor = conn.execute(
+            'INSERT INTO shipment_changes (shipment_id, op, data) VALUES (?, ?, ?)',
+            (shipment_id, op, json.dumps(data, default=str)),
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def record_many(conn, changes):
+        """
+        Appends (shipment_id, op, data) changes in the caller's transaction.
+        """
+        conn.executemany(
+            'INSERT INTO shipment_changes (shipment_id, op, data) VALUES (?, ?, ?)',
+            [(shipment_id, op, json.dumps(data, default=str)) for shipment_id, op, data in changes],
+        )
+
+    def notify(self):
+        """
+        Wakes the poller after a local commit. Safe to call from any thread.
+        """
+        if self._loop is not None and self._wakeup is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # loop already closed (shutdown)
+
+    # ---- read side ----
+
+    def read_since(self, seq, limit=CHANGEFEED_PAGE):
+        rows = self.pool.connection().execute(
+            'SELECT seq, shipment_id, op, data, created_at FROM shipment_changes WHERE seq > ? ORDER BY seq LIMIT ?',
+            (seq, limit),
+        ).fetchall()
+        return [
+            {"seq": seq, "shipment_id": shipment_id, "op": op, "data": json.loads(data), "at": created_at}
+            for seq, shipment_id, op, data, created_at in rows
+        ]
+
+    def head(self):
+        row = self.pool.connection().execute('SELECT MIN(seq), MAX(seq) FROM shipment_changes').fetchone()
+        return (row[0] or 0), (row[1] or 0)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.last_seq = (await asyncio.to_thread(self.head))[1]
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in list(self._subscribers):
+            while queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)  # end of stream
+
+    async def _poll(self):
+        last_prune = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                if not self._subscribers:
+                    # Nobody listening: just track the head so new subscribers start there
+                    head = (await asyncio.to_thread(self.head))[1]
+                    if not self._subscribers:
+                        self.last_seq = max(self.last_seq, head)
+                        continue
+                    # Someone subscribed during the await: their cursor is the old
+                    # last_seq, so publish from there instead of skipping ahead
+
+                while True:
+                    events = await asyncio.to_thread(self.read_since, self.last_seq)
+                    self.polls += 1
+                    if not events:
+                        break
+                    self.last_seq = events[-1]["seq"]
+                    self._publish(events)
+                    if len(events) < CHANGEFEED_PAGE:
+                        break
+
+                if time.monotonic() - last_prune > 60:
+                    last_prune = time.monotonic()
+                    await asyncio.to_thread(self.prune)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Change feed poll failed: {e}")
+
+    def _publish(self, events):
+        for queue in list(self._subscribers):
+            if queue.full():
+                # Slow consumer: signal it to catch up from the table instead of buffering forever
+                self.lagged += 1
+                queue.lagging = True
+                continue
+            queue.put_nowait(events)
+        self.published += len(events)
+
+    def prune(self):
+        """
+        Keeps the newest `retention` changes.
+        """
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM shipment_changes WHERE seq <= (SELECT MAX(seq) FROM shipment_changes) - ?',
+                         (self.retention,))
+
+    def can_resume(self, since):
+        """
+        False if changes after `since` were already pruned (the client must reload its snapshot).
+        """
+        first, _ = self.head()
+        return not first or since >= first - 1
+
+    async def subscribe(self, since=None, heartbeat=None):
+        """
+        Async generator of change events with seq > since (default: only new ones).
+        Yields None after `heartbeat` idle seconds (keep-alive for SSE).
+        Check can_resume(since) first: pruned history is silently skipped here.
+        """
+        queue = asyncio.Queue(self.queue_size)
+        queue.lagging = False
+        self._subscribers.add(queue)  # subscribe BEFORE the backfill so nothing falls in between
+        try:
+            cursor = self.last_seq if since is None else since
+            catch_up = cursor < self.last_seq
+
+            while True:
+                if catch_up or queue.lagging:
+                    # Backfill / catch-up straight from the table
+                    catch_up = queue.lagging = False
+                    while True:
+                        events = await asyncio.to_thread(self.read_since, cursor)
+                        for event in events:
+                            yield event
+                            cursor = event["seq"]
+                        if len(events) < CHANGEFEED_PAGE:
+                            break
+                    continue
+
+                try:
+                    events = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if events is None:
+                    return
+                for event in events:
+                    if event["seq"] > cursor:  # skip anything the backfill already sent
+                        yield event
+                        cursor = event["seq"]
+        finally:
+            self._subscribers.discard(queue)
+
+    def stats(self):
+        first, last = self.head()
+        return {
+            "subscribers": len(self._subscribers),
+            "last_seq": self.last_seq,
+            "retained": {"first_seq": first, "last_seq": last},
+            "polls": self.polls,
+            "published": self.published,
+            "lagged": self.lagged,
+        }
@@ -0,0 +1,217 @@
+"""
+Content-Addressed Training Data Cache (Box archive + featurized arrays).
+
+Layout under SENTRIA_TRAINING_CACHE_DIR:
+    archives/<sha1>.bin                       raw archive, named by its content hash
+    archives/box-<file_id>.json               last known {sha1, etag} for a Box file (offline fallback)
+    features/<sha1[:16]>-f<featurizer>-v<vocab>-<extra>-n<num_samples>/
+        features.npy / classes.npy / quantities.npy / meta.json
+
+The archive is only downloaded when Box reports a SHA-1 we do not have (it
+is featurized while it streams in, see ArchiveDownload), and
+featurized arrays are keyed by archive hash + FEATURIZER_VERSION + the
+vocabulary fingerprint (a content hash of drug_vocabulary.json and
+synonym_map.json, since term IDs depend on them) + the training-side label
+version and sample count. A repeat run with the same data and featurizer
+skips download, parsing and featurization and memory-maps the .npy files
+straight into the dataset; editing either vocabulary file is a cache miss.
+
+Every entry is written to a temporary path and renamed into place, so an
+interrupted run never leaves a half-written entry behind.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import requests
+
+from vectorizer import FEATURIZER_VERSION, get_vectorizer
+
+TRAINING_CACHE_ENABLED = os.getenv("SENTRIA_TRAINING_CACHE", "1") != "0"
+TRAINING_CACHE_DIR = os.getenv("SENTRIA_TRAINING_CACHE_DIR", "backend/.cache/training")
+HASH_CHUNK_SIZE = 1 << 20  # 1 MB
+FEATURE_ARRAYS = ("features", "classes", "quantities")
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TrainingDataCache:
+    """
+    On-disk cache of raw training archives and their featurized arrays.
+    """
+
+    def __init__(self, root=TRAINING_CACHE_DIR):
+        self.root = root
+        self.archive_dir = os.path.join(root, "archives")
+        self.feature_dir = os.path.join(root, "features")
+        os.makedirs(self.archive_dir, exist_ok=True)
+        os.makedirs(self.feature_dir, exist_ok=True)
+
+    # ---- raw archives ----
+
+    def archive_path(self, sha1):
+        return os.path.join(self.archive_dir, f"{sha1}.bin")
+
+    def box_version(self, file_id, headers, timeout=60):
+        """
+        Returns ({sha1, etag}, local path or None) for the current version of a Box file.
+
+        1. Asks Box for the file's SHA-1 / ETag (metadata only, no content)
+        2. Cache hit: returns the local copy's path
+        3. Miss: returns None as the path (see box_download)
+        4. Box unreachable: falls back to the last version seen, if cached
+        """
+        pointer = self._box_pointer(file_id)
+        try:
+            response = requests.get(f"https://api.box.com/2.0/files/{file_id}", params={"fields": "sha1,etag,size"},
+                                    headers=headers, timeout=timeout)
+            response.raise_for_status()
+            info = response.json()
+        except requests.RequestException as e:
+            if os.path.exists(pointer):
+                with open(pointer) as f:
+                    info = json.load(f)
+                if os.path.exists(self.archive_path(info["sha1"])):
+                    print(f"⚠️ Box metadata unavailable ({e}). Using cached archive {info['sha1'][:12]}.")
+                    return info, self.archive_path(info["sha1"])
+            raise
+
+        sha1 = info["sha1"]
+        path = self.archive_path(sha1)
+        if not os.path.exists(path):
+            print(f"⬇️  Box archive {sha1[:12]} ({int(info.get('size') or 0) / 1e6:.1f} MB) not cached yet.")
+            return info, None
+        print(f"📦 Box archive {sha1[:12]} (etag {info.get('etag')}) already cached. Skipping download.")
+        self._write_json(pointer, {"sha1": sha1, "etag": info.get("etag")})
+        return info, path
+
+    def box_download(self, file_id, headers, info, timeout=60):
+        """
+        Starts caching the Box file version `info` (from box_version) as it is read.
+        """
+        return ArchiveDownload(self, file_id, headers, info, timeout)
+
+    def _box_pointer(self, file_id):
+        return os.path.join(self.archive_dir, f"box-{file_id}.json")
+
+    # ---- featurized arrays ----
+
+    def features_key(self, archive_sha1, num_samples, extra=""):
+        return f"{archive_sha1[:16]}-f{FEATURIZER_VERSION}-v{get_vectorizer().fingerprint}-{extra or 'x'}-n{num_samples}"
+
+    def load_features(self, key):
+        """
+        Returns {name: memory-mapped array} or None on a miss. The maps are
+        copy-on-write, so torch can wrap them without ever writing to the cache.
+        """
+        entry = os.path.join(self.feature_dir, key)
+        if not os.path.exists(os.path.join(entry, "meta.json")):
+            return None
+        try:
+            return {name: np.load(os.path.join(entry, f"{name}.npy"), mmap_mode="c") for name in FEATURE_ARRAYS}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable feature cache entry {key}: {e}")
+            return None
+
+    def save_features(self, key, arrays, meta=None):
+        entry = os.path.join(self.feature_dir, key)
+        tmp_entry = tempfile.mkdtemp(dir=self.feature_dir, prefix=".tmp-")
+        try:
+            for name in FEATURE_ARRAYS:
+                np.save(os.path.join(tmp_entry, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+            # meta.json is written last: its presence marks a complete entry
+            self._write_json(os.path.join(tmp_entry, "meta.json"), {
+                "featurizer_version": FEATURIZER_VERSION,
+                "vocab_fingerprint": get_vectorizer().fingerprint,
+                "rows": int(len(arrays["features"])),
+                **(meta or {}),
+            })
+            if os.path.exists(entry):
+                shutil.rmtree(entry)  # stale/incomplete entry with the same key
+            os.replace(tmp_entry, entry)
+        except BaseException:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+class ArchiveDownload:
+    """
+    Readable stream over a Box archive download that is written to the cache
+    as it is read, so featurization does not wait for the whole download.
+
+    The request is only sent on the first read(). finish() reads whatever the
+    consumer left, verifies the SHA-1 and moves the archive into place; an
+    archive that was only partly read (num_samples reached early) is
+    discarded on close(), since the rest was never downloaded.
+    """
+
+    def __init__(self, cache, file_id, headers, info, timeout):
+        self.cache = cache
+        self.file_id = file_id
+        self.headers = headers
+        self.sha1 = info["sha1"]
+        self.etag = info.get("etag")
+        self.timeout = timeout
+        self.digest = hashlib.sha1()
+        self.response = None
+        self.file = None
+        self.tmp_path = None
+
+    def _open(self):
+        self.response = requests.get(f"https://api.box.com/2.0/files/{self.file_id}/content", headers=self.headers,
+                                     stream=True, timeout=self.timeout)
+        self.response.raise_for_status()
+        # Undo any transport-level Content-Encoding: the SHA-1 is over the file's own bytes
+        self.response.raw.decode_content = True
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.cache.archive_dir, suffix=".part")
+        self.file = os.fdopen(fd, "wb")
+
+    def read(self, size=-1):
+        if self.response is None:
+            self._open()
+        data = self.response.raw.read(size)
+        self.digest.update(data)
+        self.file.write(data)
+        return data
+
+    def finish(self):
+        """
+        Completes the download, verifies it and caches it. Returns the archive path.
+        """
+        while self.read(HASH_CHUNK_SIZE):
+            pass
+        self.file.close()
+        if self.digest.hexdigest() != self.sha1:
+            raise ValueError(f"Downloaded archive SHA-1 {self.digest.hexdigest()} does not match Box ({self.sha1})")
+        path = self.cache.archive_path(self.sha1)
+        os.replace(self.tmp_path, path)
+        self.tmp_path = None
+        self.cache._write_json(self.cache._box_pointer(self.file_id), {"sha1": self.sha1, "etag": self.etag})
+        return path
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        if self.tmp_path is not None and os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+        if self.response is not None:
+            self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,96 @@
+import contextlib
+import os
+import sqlite3
+import threading
+
+# SQLite Tuning (override per deployment)
+# - WAL lets readers proceed while a writer commits, and turns each commit into
+#   a sequential append instead of a rollback-journal rewrite.
+# - synchronous=FULL (default) fsyncs the WAL on every commit, so an acknowledged
+#   write to the memory store or the HIPAA audit_log survives power loss.
+#   NORMAL (opt-in) skips that fsync: still safe across application crashes
+#   in WAL mode, but the last commits can be lost on power loss / OS crash.
+SQLITE_SYNCHRONOUS = os.getenv("SENTRIA_SQLITE_SYNCHRONOUS", "FULL")
+SQLITE_CACHE_KB = int(os.getenv("SENTRIA_SQLITE_CACHE_KB", "16384"))  # page cache per connection
+SQLITE_MMAP_BYTES = int(os.getenv("SENTRIA_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SENTRIA_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SENTRIA_SQLITE_STATEMENT_CACHE", "256"))
+
+
+class SQLitePool:
+    """
+    Per-thread pooled SQLite connections.
+
+    Each worker thread lazily opens ONE connection, tunes it (WAL, pragmas)
+    and keeps reusing it, so an endpoint + its audit write no longer pay for
+    two or three connect/close cycles. Compiled statements stay cached on the
+    connection (`cached_statements`), so repeated queries skip re-preparing.
+
+    Connections are also tagged with the owning PID: a process forked from the
+    pre-fork master never touches the master's handles.
+    """
+
+    def __init__(self, path, synchronous=SQLITE_SYNCHRONOUS):
+        self.path = path
+        self.synchronous = synchronous.upper()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self.opened = 0
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+
+        with self._lock:
+            self._connections.append(conn)
+            self.opened += 1
+        return conn
+
+    def connection(self):
+        """
+        Returns this thread's connection, opening it on first use.
+        """
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            self._local.conn = self._open()
+            self._local.pid = pid
+        return self._local.conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Commits on success, rolls back on any exception.
+        """
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close(self):
+        """
+        Closes every connection this process opened (e.g. in the master before forking).
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def stats(self):
+        return {"path": self.path, "connections_opened": self.opened, "synchronous": SQLITE_SYNCHRONOUS}
@@ -0,0 +1,59 @@
+"""
+Versioned Storage Envelope for Encrypted Memory Values.
+
+Legacy rows (format 0) are a Fernet token stored as base64 TEXT:
+    Fernet(json.dumps(value))
+
+Format 1 rows are raw bytes stored as a BLOB:
+    [0]   FORMAT_VERSION (0x01)
+    [1]   codec (CODEC_NONE / CODEC_ZLIB)
+    [2:]  Fernet token, base64-decoded (no 33% base64 overhead)
+
+The JSON is compressed BEFORE encryption (ciphertext does not compress),
+and only when it is at least COMPRESS_MIN_BYTES long: small values stay
+uncompressed, which avoids paying CPU for a few saved bytes.
+"""
+import base64
+import json
+import os
+import zlib
+
+FORMAT_VERSION = 1
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+
+COMPRESS_MIN_BYTES = int(os.getenv("SENTRIA_MEMORY_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.getenv("SENTRIA_MEMORY_COMPRESS_LEVEL", "1"))  # 1 = fastest
+
+def seal(cipher, value, compress_min_bytes=COMPRESS_MIN_BYTES):
+    """
+    Serializes, (optionally) compresses and encrypts a JSON value into a format 1 envelope.
+    """
+    raw_json = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    codec = CODEC_NONE
+    if compress_min_bytes >= 0 and len(raw_json) >= compress_min_bytes:
+        compressed = zlib.compress(raw_json, COMPRESS_LEVEL)
+        if len(compressed) < len(raw_json):
+            raw_json, codec = compressed, CODEC_ZLIB
+
+    token = base64.urlsafe_b64decode(cipher.encrypt(raw_json))
+    return bytes((FORMAT_VERSION, codec)) + token
+
+def unseal(cipher, stored):
+    """
+    Decrypts a stored value of ANY format back into the JSON object.
+    """
+    if isinstance(stored, str):
+        # Format 0: legacy base64 Fernet token of the plain JSON
+        return json.loads(cipher.decrypt(stored.encode("utf-8")).decode("utf-8"))
+
+    stored = bytes(stored)
+    if stored[0] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported memory envelope format: {stored[0]}")
+    codec = stored[1]
+    payload = cipher.decrypt(base64.urlsafe_b64encode(stored[2:]))
+    if codec == CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    elif codec != CODEC_NONE:
+        raise ValueError(f"Unsupported memory envelope codec: {codec}")
+    return json.loads(payload)
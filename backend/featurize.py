@@ -0,0 +1,256 @@
+"""
+Parallel Featurization of Training Records (train.py).
+
+The ingest stream is cut into chunks and featurized across a process pool:
+1. Each chunk is handed a slot range [offset, offset + len(chunk)) in the
+   output columns (features / classes / quantities) before it is submitted
+2. The worker parses (raw NDJSON lines), vectorizes and draws the targets,
+   then writes its rows straight into the memory-mapped columns; only a
+   small summary (rows kept, error counts) travels back
+3. Rows a chunk could not use leave a gap that is compacted away once all
+   chunks are in (or when the slots run out before num_samples rows)
+
+Targets are drawn from a per-chunk seed, so the output is the same for any
+number of workers. Errors are counted per worker and per exception type
+instead of being silently skipped.
+"""
+import collections
+import concurrent.futures
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from vectorizer import FEATURE_SIZE, get_vectorizer
+
+FEATURIZE_WORKERS = int(os.getenv("SENTRIA_FEATURIZE_WORKERS", "0"))  # 0 = one per CPU
+FEATURIZE_CHUNK = int(os.getenv("SENTRIA_FEATURIZE_CHUNK", "4096"))  # records per task
+# Bump whenever simulate_targets changes (cached arrays are keyed on it)
+TARGETS_VERSION = "2"
+
+COLUMNS = (
+    ("features", np.float32, (FEATURE_SIZE,)),
+    ("classes", np.int64, ()),
+    ("quantities", np.int64, ()),
+)
+
+def simulate_targets(features, rng):
+    """
+    Draws (class, quantity) training targets for a block of feature rows.
+    """
+    n = len(features)
+    age_norm = features[:, 0]
+
+    # Target Class
+    classes = rng.integers(0, 50, size=n)
+
+    # Target Quantity (Simulated correlation with Age/Severity)
+    # e.g., Older patients need more meds, etc.
+    base_qty = 30
+    target_qty = base_qty + (age_norm * 20) + rng.normal(0, 5, size=n)
+    quantities = np.clip(np.trunc(target_qty), 10, 180).astype(np.int64)
+    return classes, quantities
+
+def featurize_chunk(items, parsed, seed):
+    """
+    Featurizes one chunk of records (or raw NDJSON lines when parsed=False).
+    Returns (features, classes, quantities, errors by type, records seen).
+    Expected format: { "age": 40, "diagnosis": "...", "vitals": ... }
+    """
+    errors = collections.Counter()
+    if parsed:
+        records = items
+    else:
+        records = []
+        for line in items:
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                errors["malformed JSON"] += 1
+
+    # Feature Extraction: the SAME vectorizer serve.py uses at inference time
+    # [AgeNorm, Gender, DiagEmbedding x7, DiagKnown]
+    vectorizer = get_vectorizer()
+    try:
+        features = vectorizer.vectorize_records(records)
+    except Exception:
+        # One bad record must not sink the chunk: redo it record by record
+        rows = []
+        for record in records:
+            try:
+                rows.append(vectorizer.vectorize_records([record])[0])
+            except Exception as e:
+                errors[type(e).__name__] += 1
+        features = np.stack(rows) if rows else np.empty((0, FEATURE_SIZE), dtype=np.float32)
+
+    classes, quantities = simulate_targets(features, np.random.default_rng(seed))
+    return features, classes, quantities, errors, len(records) + errors["malformed JSON"]
+
+class FeaturizeReport:
+    """
+    Per-worker record / row / error counts for one featurization run.
+    """
+
+    def __init__(self):
+        self.workers = collections.defaultdict(lambda: {"records": 0, "rows": 0, "errors": collections.Counter()})
+
+    def add(self, pid, records, rows, errors):
+        worker = self.workers[pid]
+        worker["records"] += records
+        worker["rows"] += rows
+        worker["errors"].update(errors)
+
+    @property
+    def errors(self):
+        return sum(sum(worker["errors"].values()) for worker in self.workers.values())
+
+    def print(self):
+        for pid, worker in sorted(self.workers.items()):
+            errors = ", ".join(f"{name}: {count}" for name, count in worker["errors"].most_common()) or "none"
+            print(f"   worker {pid}: {worker['rows']}/{worker['records']} records featurized (errors: {errors})")
+
+class _Columns:
+    """
+    Output columns: plain arrays in-process, or memory-mapped files that the
+    pool's workers open and write into directly.
+    """
+
+    def __init__(self, capacity, shared):
+        self.capacity = capacity
+        self.directory = tempfile.mkdtemp(prefix="sentria-featurize-") if shared else None
+        self.arrays = []
+        for name, dtype, shape in COLUMNS:
+            if shared:
+                path = os.path.join(self.directory, f"{name}.bin")
+                self.arrays.append(np.memmap(path, dtype=dtype, mode="w+", shape=(max(capacity, 1), *shape)))
+            else:
+                self.arrays.append(np.empty((capacity, *shape), dtype=dtype))
+
+    def write(self, offset, values):
+        for column, value in zip(self.arrays, values):
+            column[offset:offset + len(value)] = value
+
+    def compact(self, placed):
+        """
+        Moves each chunk's rows down over the gaps; `placed` is (offset, rows) per chunk.
+        Returns the number of rows.
+        """
+        end = 0
+        for offset, rows in sorted(placed):
+            if offset != end:
+                for column in self.arrays:
+                    column[end:end + rows] = column[offset:offset + rows]
+            end += rows
+        return end
+
+    def result(self, rows):
+        # Copy out of the temporary files (plain arrays are just trimmed)
+        if self.directory is None:
+            return tuple(column[:rows] for column in self.arrays)
+        return tuple(np.array(column[:rows]) for column in self.arrays)
+
+    def close(self):
+        self.arrays = []
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+# Worker side: memory-mapped output columns, opened once per worker process
+_worker_columns = {}
+
+def _featurize_into(directory, capacity, offset, items, parsed, seed):
+    columns = _worker_columns.get(directory)
+    if columns is None:
+        _worker_columns.clear()
+        columns = _worker_columns[directory] = [
+            np.memmap(os.path.join(directory, f"{name}.bin"), dtype=dtype, mode="r+", shape=(max(capacity, 1), *shape))
+            for name, dtype, shape in COLUMNS
+        ]
+    *values, errors, records = featurize_chunk(items, parsed, seed)
+    for column, value in zip(columns, values):
+        column[offset:offset + len(value)] = value
+    return os.getpid(), offset, len(values[0]), errors, records
+
+class _ChunkReader:
+    """
+    Cuts the (parsed, items) batches from ingest into chunks of any requested size.
+    """
+
+    def __init__(self, batches):
+        self.batches = iter(batches)
+        self.parsed = True
+        self.buffer = []
+        self.exhausted = False
+
+    def take(self, limit):
+        while not self.buffer and not self.exhausted:
+            batch = next(self.batches, None)
+            if batch is None:
+                self.exhausted = True
+            else:
+                self.parsed, self.buffer = batch
+        chunk, self.buffer = self.buffer[:limit], self.buffer[limit:]
+        return chunk
+
+def featurize_batches(batches, num_samples, workers=FEATURIZE_WORKERS, chunk_size=FEATURIZE_CHUNK, progress=None):
+    """
+    Featurizes up to num_samples rows from ingest batches ((parsed, items) pairs).
+    Stops pulling batches as soon as num_samples rows are done.
+    Returns ((features, classes, quantities), FeaturizeReport).
+    """
+    workers = workers or os.cpu_count() or 1
+    seed_base = int(np.random.randint(2 ** 31))  # honours np.random.seed
+    report = FeaturizeReport()
+    columns = _Columns(num_samples, shared=workers > 1)
+    pool = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else None
+
+    def submit(offset, chunk, parsed, seed):
+        if pool is not None:
+            return pool.submit(_featurize_into, columns.directory, num_samples, offset, chunk, parsed, seed)
+        future = concurrent.futures.Future()
+        *values, errors, records = featurize_chunk(chunk, parsed, seed)
+        columns.write(offset, values)
+        future.set_result((os.getpid(), offset, len(values[0]), errors, records))
+        return future
+
+    reader = _ChunkReader(batches)
+    placed = []  # (offset, rows) per finished chunk
+    pending = set()
+    handed = 0  # slots handed out so far
+    chunk_index = 0
+    try:
+        while True:
+            # Keep every worker busy (bounded, so the stream is not read ahead unboundedly)
+            while handed < num_samples and len(pending) < 2 * workers:
+                chunk = reader.take(min(chunk_size, num_samples - handed))
+                if not chunk:
+                    break
+                pending.add(submit(handed, chunk, reader.parsed, (seed_base, chunk_index)))
+                handed += len(chunk)
+                chunk_index += 1
+
+            if not pending:
+                rows = sum(rows for _, rows in placed)
+                if rows >= num_samples or reader.exhausted:
+                    break
+                # Every slot is used but some records were unusable: close the gaps, keep reading
+                placed = [(0, columns.compact(placed))]
+                handed = placed[0][1]
+                continue
+
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pid, offset, rows, errors, records = future.result()
+                placed.append((offset, rows))
+                report.add(pid, records, rows, errors)
+                if progress is not None:
+                    progress.update(rows)
+
+        return columns.result(columns.compact(placed)), report
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        columns.close()
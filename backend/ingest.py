@@ -0,0 +1,221 @@
+"""
+Streaming Training-Data Ingestion (Box archive or local file).
+
+The archive is read in fixed-size chunks, gunzipped incrementally and parsed
+one record at a time, so peak memory is a few chunks - not the ~4x archive
+size of download -> gunzip -> decode -> json.loads. Records are yielded as
+soon as they are parsed, so featurization starts with the first chunk, and a
+consumer that stops early (num_samples reached) never downloads the rest.
+
+Supported payloads (gzip-compressed or plain, detected from the bytes):
+- NDJSON: one JSON record per line
+- A JSON array of records: [ {...}, {...}, ... ]
+
+The *_batches variants yield lists of records for parallel featurization.
+NDJSON lines are passed through unparsed (bytes), so the JSON parsing can
+happen in the worker processes too (see featurize.py).
+"""
+import contextlib
+import gzip
+import io
+import json
+import re
+
+import requests
+
+CHUNK_SIZE = 1 << 16  # 64 KB
+GZIP_MAGIC = b"\x1f\x8b"
+_SEPARATORS = re.compile(r"[\s,]*")
+_TERMINATORS = frozenset(" \t\r\n,]")
+
+class IngestStats:
+    """
+    Counters for one ingestion run (records parsed / skipped, bytes read).
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.malformed = 0
+        self.compressed_bytes = 0
+
+    def __repr__(self):
+        return f"IngestStats(records={self.records}, malformed={self.malformed}, compressed_bytes={self.compressed_bytes})"
+
+class _CountingReader(io.RawIOBase):
+    """
+    Wraps a raw byte stream and counts what is read (download progress).
+    """
+
+    def __init__(self, raw, stats):
+        self.raw = raw
+        self.stats = stats
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        if not data:
+            return 0
+        buffer[:len(data)] = data
+        self.stats.compressed_bytes += len(data)
+        return len(data)
+
+def _decompressed(raw, stats):
+    """
+    Returns a buffered binary stream of the payload, gunzipping on the fly if needed.
+    """
+    stream = io.BufferedReader(_CountingReader(raw, stats), CHUNK_SIZE)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return io.BufferedReader(gzip.GzipFile(fileobj=stream, mode="rb"), CHUNK_SIZE)
+    return stream
+
+def _iter_ndjson(text, stats):
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            stats.malformed += 1
+
+def _iter_json_array(text, stats):
+    """
+    Incrementally decodes the elements of a top-level JSON array.
+    Elements are decoded in place at an offset into the buffer (no copy per
+    record); the buffer is only trimmed when the next chunk is read.
+    """
+    decoder = json.JSONDecoder()
+    buffer = text.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array")
+    pos = 1
+    eof = False
+
+    while True:
+        # Skip separators between elements
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if pos >= len(buffer) and not eof:
+            chunk = text.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = chunk, 0
+            continue
+        if pos >= len(buffer) or buffer[pos] == "]":
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+            # A value cut at the chunk boundary may decode short (e.g. "12." -> 12):
+            # it is only complete once a separator follows it
+            complete = eof or (end < len(buffer) and buffer[end] in _TERMINATORS)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            # Element continues in the next chunk
+            chunk = text.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        pos = end
+        yield record
+
+def iter_records(raw, stats=None):
+    """
+    Yields records from a raw byte stream (HTTP body, open file, ...).
+    """
+    stats = stats if stats is not None else IngestStats()
+    yield from _iter_stream(_decompressed(raw, stats), stats)
+
+def _iter_stream(stream, stats):
+    text = io.TextIOWrapper(stream, encoding="utf-8")
+
+    # Peek at the first non-whitespace character to pick the format
+    first = text.read(1)
+    while first and first.isspace():
+        first = text.read(1)
+    if not first:
+        return
+    rest = io.StringIO(first)
+    combined = _Chain(rest, text)
+
+    records = _iter_json_array(combined, stats) if first == "[" else _iter_ndjson(combined, stats)
+    for record in records:
+        stats.records += 1
+        yield record
+
+def iter_batches(raw, batch_size, stats=None):
+    """
+    Yields (parsed, items) batches of up to `batch_size` from a raw byte stream.
+
+    NDJSON batches are raw lines (parsed=False, left to the consumer, blank and
+    malformed lines included); a JSON array can only be split by parsing it,
+    so its batches hold records (parsed=True).
+    """
+    stats = stats if stats is not None else IngestStats()
+    stream = _decompressed(raw, stats)
+    head = stream.peek(CHUNK_SIZE).lstrip()
+
+    if head[:1] == b"[" or not head:
+        parsed, items = True, _iter_stream(stream, stats)
+    else:
+        parsed, items = False, stream
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield parsed, batch
+            batch = []
+    if batch:
+        yield parsed, batch
+
+class _Chain:
+    """
+    Minimal text stream that reads `head` first, then `tail` (re-attaches peeked characters).
+    """
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+
+    def read(self, size=-1):
+        data = self.head.read(size)
+        if size < 0 or len(data) < size:
+            data += self.tail.read(-1 if size < 0 else size - len(data))
+        return data
+
+    def __iter__(self):
+        first_line = self.head.read() + self.tail.readline()
+        if first_line:
+            yield first_line
+        yield from self.tail
+
+def iter_local_records(path, stats=None):
+    """
+    Local-file stand-in for the Box download (same formats, same streaming).
+    """
+    with open(path, "rb") as f:
+        yield from iter_records(f, stats)
+
+def iter_local_batches(path, batch_size, stats=None):
+    with open(path, "rb") as f:
+        yield from iter_batches(f, batch_size, stats)
+
+@contextlib.contextmanager
+def _http_body(url, headers, timeout):
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        # Undo any transport-level Content-Encoding; the archive's own gzip is handled by iter_records
+        response.raw.decode_content = True
+        yield response.raw
+
+def iter_http_batches(url, batch_size, headers=None, stats=None, timeout=60):
+    """
+    Streams batches straight off an HTTP response body (never buffered whole).
+    Raises requests.HTTPError on a non-200 response.
+    """
+    with _http_body(url, headers, timeout) as raw:
+        yield from iter_batches(raw, batch_size, stats)
@@ -0,0 +1,154 @@
+"""
+Rotatable Encryption Key Ring for the Memory Store.
+
+The key file holds one Fernet key per line, NEWEST FIRST:
+- Encryption always uses the first (primary) key.
+- Decryption tries every key (cryptography's MultiFernet).
+
+Rotating prepends a freshly generated key. Every worker notices the new file
+(mtime check, at most once per RELOAD_INTERVAL_S, or immediately when a token
+fails to decrypt), so all processes switch to the new primary key without a
+restart. Old keys stay in the file until the re-encryption job has moved
+every row off them.
+"""
+import hashlib
+import os
+import threading
+import time
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+RELOAD_INTERVAL_S = 1.0
+
+def key_id(key):
+    """
+    Short, non-secret fingerprint of a key (stored next to each row).
+    """
+    return hashlib.sha256(key).hexdigest()[:12]
+
+class KeyRing:
+    """
+    Newest-first list of Fernet keys backed by a key file.
+    """
+
+    def __init__(self, path, lock=None):
+        self.path = path
+        # Context manager serializing key file creation/rotation across workers
+        self.lock = lock
+        self._mutex = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.keys = []
+        self.cipher = None
+        self.primary_id = None
+        self._load(create=True)
+
+    def _locked(self):
+        if self.lock is None:
+            return _NullLock()
+        return self.lock()
+
+    def _load(self, create=False):
+        with self._locked():
+            if not os.path.exists(self.path):
+                if not create:
+                    raise FileNotFoundError(self.path)
+                # Generate new AES-256 compatible key
+                # Persist locally (DEV MODE ONLY - Production should use Vault)
+                self._write([Fernet.generate_key()])
+                print(f"🔐 Generated new AES-256 Encryption Key at {self.path}")
+            with open(self.path, "rb") as key_file:
+                keys = [line.strip() for line in key_file.read().splitlines() if line.strip()]
+            mtime = os.stat(self.path).st_mtime_ns
+
+        if not keys:
+            raise ValueError(f"No encryption keys found in {self.path}")
+        with self._mutex:
+            self.keys = keys
+            self.cipher = MultiFernet([Fernet(key) for key in keys])
+            self.primary_id = key_id(keys[0])
+            self.key_ids = [key_id(key) for key in keys]
+            self._primary = (self.cipher, self.primary_id)
+            self._mtime = mtime
+            self._checked_at = time.monotonic()
+
+    def _write(self, keys):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as key_file:
+            key_file.write(b"\n".join(keys) + b"\n")
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)  # atomic: readers see the old or the new file
+
+    def refresh(self, force=False):
+        """
+        Reloads the key file if another process rotated it. Returns True if reloaded.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_INTERVAL_S:
+            return False
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._load()
+        return True
+
+    def current(self):
+        """
+        Returns the cipher for this request (picks up rotations by other workers).
+        """
+        self.refresh()
+        return self.cipher
+
+    def current_key(self):
+        """
+        Returns (cipher, primary key id) as one consistent pair, for writes
+        that record which key encrypted them.
+        """
+        self.refresh()
+        return self._primary
+
+    def decrypt_with_retry(self, fn):
+        """
+        Runs fn(cipher). On InvalidToken, reloads the key file once and retries:
+        the row may have been re-encrypted under a key another worker just added.
+        """
+        try:
+            return fn(self.current())
+        except InvalidToken:
+            if not self.refresh(force=True):
+                raise
+            return fn(self.cipher)
+
+    def rotate(self):
+        """
+        Generates a new primary key and prepends it to the key file. Returns its key id.
+        """
+        with self._locked():
+            with open(self.path, "rb") as key_file:
+                keys = [line.strip() for line in key_file.read().splitlines() if line.strip()]
+            self._write([Fernet.generate_key()] + keys)
+        self._load()
+        print(f"🔐 Rotated memory encryption key (primary {self.primary_id}, {len(self.keys)} keys on ring)")
+        return self.primary_id
+
+    def retire(self, keep=1):
+        """
+        Drops all but the newest `keep` keys. Only safe once no row uses them.
+        """
+        with self._locked():
+            with open(self.path, "rb") as key_file:
+                keys = [line.strip() for line in key_file.read().splitlines() if line.strip()]
+            self._write(keys[:max(1, keep)])
+        self._load()
+        return self.key_ids
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
@@ -31,3 +31,12 @@ class ClinicalNetwork(nn.Module):
         pred_qty = F.relu(self.output_qty(x)) # Quantity must be positive
         
         return logits_class, pred_qty
+
+
+def quantize_for_inference(model):
+    """
+    Dynamic int8 quantization of the nn.Linear layers (CPU only).
+    Weights are stored as int8; activations are quantized on the fly per batch.
+    """
+    model = model.to("cpu").eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
@@ -0,0 +1,187 @@
+"""
+Torch-Free Inference Engine for ClinicalNetwork.
+
+Inference-only pods only need a forward pass through four dense layers, so
+this module re-implements ClinicalNetwork.forward with vectorized NumPy
+(batched matmul -> ReLU -> softmax) and never imports torch.
+
+Weights can be loaded from:
+1. The `.pth` state_dict written by train.py (read straight from the zip
+   archive with a restricted unpickler - no torch required).
+2. The ClinicalNetwork weights.json export written by train.py
+   (backend/clinical_model_final.weights.json): a JSON list of flat arrays,
+   [kernel, bias] per layer in LAYER_ORDER, with kernels in
+   (in_features, out_features) layout.
+
+Only ClinicalNetwork weights are supported. `ai_model_trained/weights.json`
+(the TF.js run_training_cli.ts model, 26 -> 64 -> 32 -> 5) uses the same list
+layout but is a different network and is rejected.
+"""
+import collections
+import json
+import pickle
+import zipfile
+
+import numpy as np
+
+# Layer order shared by the .pth state_dict and the weights.json list
+LAYER_ORDER = ("fc1", "fc2", "fc3", "output_class", "output_qty")
+
+_STORAGE_DTYPES = {
+    "FloatStorage": np.float32,
+    "DoubleStorage": np.float64,
+    "HalfStorage": np.float16,
+    "LongStorage": np.int64,
+    "IntStorage": np.int32,
+    "ShortStorage": np.int16,
+    "CharStorage": np.int8,
+    "ByteStorage": np.uint8,
+    "BoolStorage": np.bool_,
+}
+
+def _rebuild_tensor(storage, storage_offset, size, stride, *_):
+    itemsize = storage.itemsize
+    view = np.lib.stride_tricks.as_strided(
+        storage[storage_offset:],
+        shape=tuple(size),
+        strides=tuple(step * itemsize for step in stride),
+    )
+    return np.array(view)
+
+def _rebuild_parameter(data, *_):
+    return data
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    """
+    Unpickles a torch zip checkpoint into NumPy arrays.
+    Only the globals a plain state_dict needs are allowed (like weights_only=True).
+    """
+
+    def __init__(self, file, archive, prefix, byteorder):
+        super().__init__(file)
+        self.archive = archive
+        self.prefix = prefix
+        self.byteorder = byteorder
+
+    def find_class(self, module, name):
+        if module == "collections" and name == "OrderedDict":
+            return collections.OrderedDict
+        if module == "torch._utils" and name == "_rebuild_tensor_v2":
+            return _rebuild_tensor
+        if module == "torch._utils" and name == "_rebuild_parameter":
+            return _rebuild_parameter
+        if module == "torch" and name in _STORAGE_DTYPES:
+            return name
+        raise pickle.UnpicklingError(f"Unsupported object in checkpoint: {module}.{name}")
+
+    def persistent_load(self, pid):
+        _, storage_type, key, _location, _numel = pid
+        dtype = np.dtype(_STORAGE_DTYPES[storage_type]).newbyteorder("<" if self.byteorder == "little" else ">")
+        raw = self.archive.read(f"{self.prefix}/data/{key}")
+        return np.frombuffer(raw, dtype=dtype).astype(dtype.newbyteorder("="))
+
+def load_state_dict(path):
+    """
+    Reads a torch.save()'d state_dict (.pth zip format) without importing torch.
+    Returns an OrderedDict of parameter name -> np.ndarray.
+    """
+    with zipfile.ZipFile(path) as archive:
+        pickle_name = next(name for name in archive.namelist() if name.endswith("/data.pkl"))
+        prefix = pickle_name[: -len("/data.pkl")]
+        byteorder = "little"
+        if f"{prefix}/byteorder" in archive.namelist():
+            byteorder = archive.read(f"{prefix}/byteorder").decode().strip()
+
+        with archive.open(pickle_name) as f:
+            return _CheckpointUnpickler(f, archive, prefix, byteorder).load()
+
+def to_weights_list(state_dict):
+    """
+    Converts a ClinicalNetwork state_dict (name -> array) into the weights.json
+    export format: [kernel (in, out) flattened, bias] per layer, in LAYER_ORDER.
+    """
+    weights = []
+    for layer in LAYER_ORDER:
+        weights.append(np.asarray(state_dict[f"{layer}.weight"], dtype=np.float32).T.ravel().tolist())
+        weights.append(np.asarray(state_dict[f"{layer}.bias"], dtype=np.float32).ravel().tolist())
+    return weights
+
+def from_weights_list(weights):
+    """
+    Inverse of to_weights_list(). Layer shapes are inferred from the bias
+    lengths, so any input_size / num_classes round-trips.
+    """
+    if len(weights) != 2 * len(LAYER_ORDER):
+        raise ValueError(
+            f"Expected {2 * len(LAYER_ORDER)} weight arrays (ClinicalNetwork export from train.py), got {len(weights)}"
+        )
+
+    state_dict = collections.OrderedDict()
+    for i, layer in enumerate(LAYER_ORDER):
+        kernel = np.asarray(weights[2 * i], dtype=np.float32)
+        bias = np.asarray(weights[2 * i + 1], dtype=np.float32)
+        out_features = bias.shape[0]
+        if kernel.size % out_features:
+            raise ValueError(f"Kernel for {layer} does not match its bias ({kernel.size} vs {out_features})")
+        state_dict[f"{layer}.weight"] = kernel.reshape(-1, out_features).T
+        state_dict[f"{layer}.bias"] = bias
+    return state_dict
+
+class NumpyClinicalNetwork:
+    """
+    NumPy mirror of ClinicalNetwork in eval mode (dropout is a no-op).
+    Kernels are kept in (in, out) layout so each layer is a single `x @ W + b`.
+    """
+
+    def __init__(self, state_dict):
+        self.layers = {}
+        for layer in LAYER_ORDER:
+            kernel = np.ascontiguousarray(np.asarray(state_dict[f"{layer}.weight"], dtype=np.float32).T)
+            bias = np.asarray(state_dict[f"{layer}.bias"], dtype=np.float32)
+            self.layers[layer] = (kernel, bias)
+
+        self.input_size = self.layers["fc1"][0].shape[0]
+        self.num_classes = self.layers["output_class"][0].shape[1]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads weights from a .pth checkpoint or a weights.json written by train.py.
+        """
+        if path.endswith(".json"):
+            with open(path) as f:
+                return cls(from_weights_list(json.load(f)))
+        return cls(load_state_dict(path))
+
+    def _dense(self, x, layer):
+        kernel, bias = self.layers[layer]
+        return x @ kernel + bias
+
+    def forward(self, x):
+        """
+        Returns (logits_class, pred_qty) for a (N, input_size) batch.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        x = np.maximum(self._dense(x, "fc1"), 0.0)
+        x = np.maximum(self._dense(x, "fc2"), 0.0)
+        x = np.maximum(self._dense(x, "fc3"), 0.0)
+
+        # Branching
+        logits_class = self._dense(x, "output_class")
+        pred_qty = np.maximum(self._dense(x, "output_qty"), 0.0) # Quantity must be positive
+        return logits_class, pred_qty
+
+    __call__ = forward
+
+    def predict(self, x):
+        """
+        Returns per-row (class_idx, confidence, quantity), matching serve.forward_batch.
+        """
+        logits, qty = self.forward(x)
+
+        # Numerically stable softmax: only the winning probability is needed
+        shifted = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(shifted)
+        idx = np.argmax(logits, axis=1)
+        confidence = 1.0 / exp.sum(axis=1)  # exp(max - max) == 1
+        return idx, confidence.astype(np.float32), qty[:, 0]
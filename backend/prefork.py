@@ -0,0 +1,162 @@
+"""
+Pre-Fork Multi-Worker Launcher.
+
+    python -m backend.prefork --workers 4 --port 8000
+
+`uvicorn --workers N` spawns N fresh interpreters: each one imports torch,
+rebuilds ClinicalNetwork and re-runs the import-time setup on its own.
+Instead, the master here:
+1. Imports backend.serve ONCE (encryption key, SQLite schema init).
+2. Loads the model weights ONCE.
+3. Binds the listening socket, then forks the workers.
+
+Workers inherit the model copy-on-write, so only the pages a worker actually
+writes are duplicated. Memory per worker stays flat as cores are added.
+
+Hot reload (`kill -HUP <master pid>`, or POST /admin/model/reload on any
+worker): the master forwards SIGHUP to every worker, each of which reloads
+its own model, then reloads its own copy so restarted workers fork the new
+model too.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sentria AI pre-fork server")
+    parser.add_argument("--host", default=os.getenv("SENTRIA_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SENTRIA_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SENTRIA_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args()
+
+
+def bind_socket(host, port, backlog):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, log_level):
+    # Workers handle their own signals (uvicorn installs graceful-shutdown handlers)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    args = parse_args()
+
+    # 1. One-time setup + shared model load, BEFORE forking.
+    # Warmup is deferred to each worker: starting intra-op thread pools in the
+    # master would leave forked children with unusable OpenMP state.
+    from backend import serve
+    serve.load_model(warmup=False)
+    serve.prefork_master_pid = os.getpid()
+
+    # SQLite handles must never cross a fork; each worker opens its own
+    serve.db_pool.close()
+
+    # Move everything allocated so far out of the GC's tracked generations, so
+    # collections in the workers never touch (and therefore copy) those pages
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    print(f"🍴 Pre-forking {args.workers} workers on http://{args.host}:{args.port} (master pid {os.getpid()})")
+
+    workers = {}
+    shutting_down = False
+
+    def spawn():
+        # The child keeps SIGHUP blocked until its event loop has taken it over,
+        # so a reload forwarded during startup is held back instead of running
+        # the master's handler in the worker
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGHUP})
+        try:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    run_worker(serve.app, sock, args.log_level)
+                finally:
+                    os._exit(0)
+            workers[pid] = time.monotonic()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGHUP})
+
+    def stop(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    reloading = False
+    reload_pending = False
+
+    def reload(signum, frame):
+        nonlocal reloading, reload_pending
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+        # Workers restarted later fork from the master's copy: refresh it too.
+        # A SIGHUP arriving mid-reload is forwarded above and queued here
+        # (load_model's lock is not re-entrant).
+        reload_pending = True
+        if reloading:
+            return
+        reloading = True
+        try:
+            while reload_pending:
+                reload_pending = False
+                serve.load_model(warmup=False)
+        finally:
+            reloading = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, reload)
+
+    for _ in range(args.workers):
+        spawn()
+
+    # 2. Supervise: restart crashed workers (they re-fork from the preloaded master)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None or shutting_down:
+            continue
+
+        print(f"⚠️ Worker {pid} exited (status {status}). Restarting...")
+        if time.monotonic() - started < 1.0:
+            # Crash loop guard
+            time.sleep(1.0)
+        spawn()
+
+    sock.close()
+    print("Sentria AI pre-fork master stopped.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,28 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-import torch
+from typing import Optional
 import numpy as np
-from backend.model import ClinicalNetwork
+from backend.batching import BoundedExecutor, InferenceBatcher, InferenceOverloaded
+from backend.cache import TTLCache
+from backend.vectorizer import get_vectorizer
+import asyncio
+import json
 import os
+import signal
+import threading
+import time
+
+# Inference Engine: "torch" (default) or "numpy".
+# The NumPy engine never imports torch (fast cold start, low RSS for inference-only pods).
+INFERENCE_ENGINE = os.getenv("SENTRIA_ENGINE", "torch").lower()
+if INFERENCE_ENGINE == "numpy":
+    from backend.numpy_engine import NumpyClinicalNetwork
+else:
+    import torch
+    from backend.model import ClinicalNetwork, quantize_for_inference
 
 app = FastAPI()
-# Trigger Reload: New Model Available
 
 # Input Schema
 class PatientData(BaseModel):
@@ -17,66 +33,484 @@ class PatientData(BaseModel):
 
 # Load Model (Lazy Loading)
 model = None
-device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+model_format = None
+model_version = 0
 
-def load_model():
-    global model
-    try:
-        model_path = "backend/clinical_model_final.pth"
-        if not os.path.exists(model_path):
-             print(f"⚠️ Model not found at {model_path}. Running in Stub Mode.")
-             return
-
-        # Initialize same architecture
-        model = ClinicalNetwork(input_size=10, num_classes=50).to(device)
-        model.load_state_dict(torch.load(model_path, map_location=device))
-        model.eval()
-        print(f"✅ Model Loaded from {model_path}")
-    except Exception as e:
-        print(f"❌ Failed to load model: {e}")
+MODEL_PATH = "backend/clinical_model_final.pth"
+# Frozen, inference-only TorchScript artifacts (written by `python backend/train.py --export`)
+TORCHSCRIPT_PATH = "backend/clinical_model_final.torchscript.pt"
+QUANTIZED_TORCHSCRIPT_PATH = "backend/clinical_model_final.int8.torchscript.pt"
+# Torch-free weights for SENTRIA_ENGINE=numpy (falls back to reading MODEL_PATH directly)
+WEIGHTS_JSON_PATH = "backend/clinical_model_final.weights.json"
 
-@app.on_event("startup")
-async def startup_event():
-    load_model()
-    print("Sentria AI Server Started.")
+# Opt-in int8 dynamic quantization of the Linear layers (CPU only).
+# Check the accuracy cost first with `python backend/verify_model.py`.
+QUANTIZE = os.getenv("SENTRIA_QUANTIZE", "0") == "1"
 
-@app.post("/predict")
-async def predict_drug(patient: PatientData):
-    if not model:
-         # Fallback for Demo before Models are trained
-         return {
-            "recommended_drug": "Metformin (Fallback - Model Not Trained)",
-            "confidence": 0.0,
-            "source": "Python-Backend-Stub"
-        }
+# CPU Threading: intra-op threads parallelize a single matmul,
+# inter-op threads run independent ops concurrently. 0 = PyTorch default.
+TORCH_THREADS = int(os.getenv("SENTRIA_TORCH_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.getenv("SENTRIA_TORCH_INTEROP_THREADS", "0"))
+
+if INFERENCE_ENGINE == "numpy":
+    device = "cpu"
+else:
+    device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+    if TORCH_INTEROP_THREADS > 0:
+        # Must run before any inter-op parallel work has started
+        torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+
+# Prediction Cache
+# Repeated age/gender/diagnosis combinations skip the model entirely.
+# Keyed on the feature vector snapped to a fixed grid; flushed on every model (re)load.
+PREDICTION_CACHE_SIZE = int(os.getenv("SENTRIA_PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("SENTRIA_PREDICTION_CACHE_TTL", "300"))
+PREDICTION_CACHE_RESOLUTION = float(os.getenv("SENTRIA_PREDICTION_CACHE_RESOLUTION", "1e-4"))
+prediction_cache = TTLCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+
+def prediction_cache_key(features: np.ndarray):
+    """
+    Quantizes a feature row so float noise below the resolution shares an entry.
+    The model version is part of the key, so in-flight requests that finish on
+    an old model can never poison the cache of the new one.
+    """
+    grid = np.round(features / PREDICTION_CACHE_RESOLUTION).astype(np.int64)
+    return (model_version, grid.tobytes())
+
+def build_numpy_model():
+    # Prefer the exported weights.json unless the checkpoint has been retrained since
+    if os.path.exists(WEIGHTS_JSON_PATH) and not (
+        os.path.exists(MODEL_PATH) and os.path.getmtime(MODEL_PATH) > os.path.getmtime(WEIGHTS_JSON_PATH)
+    ):
+        weights_path = WEIGHTS_JSON_PATH
+    elif os.path.exists(MODEL_PATH):
+        weights_path = MODEL_PATH
+    else:
+        return None, None, None
+
+    return NumpyClinicalNetwork.load(weights_path), "numpy", weights_path
+
+def build_model():
+    """
+    Loads the newest model artifact WITHOUT touching the live model.
+    Returns (model, format, source_path), or (None, None, None) if nothing is trained yet.
+    """
+    if INFERENCE_ENGINE == "numpy":
+        return build_numpy_model()
+
+    suffix = "-int8" if QUANTIZE else ""
+
+    # 1. Prefer the frozen TorchScript artifact (no Python module rebuild, no dropout nodes)
+    # Skip it if the eager checkpoint has been retrained since the export.
+    torchscript_path = QUANTIZED_TORCHSCRIPT_PATH if QUANTIZE else TORCHSCRIPT_PATH
+    if os.path.exists(torchscript_path):
+        if os.path.exists(MODEL_PATH) and os.path.getmtime(MODEL_PATH) > os.path.getmtime(torchscript_path):
+            print(f"⚠️ {torchscript_path} is older than {MODEL_PATH}. Re-export it; using eager model.")
+        else:
+            candidate = torch.jit.load(torchscript_path, map_location=device)
+            return candidate, "torchscript" + suffix, torchscript_path
+
+    if not os.path.exists(MODEL_PATH):
+        return None, None, None
+
+    # 2. Eager fallback: Initialize same architecture
+    candidate = ClinicalNetwork(input_size=10, num_classes=50).to(device)
+    candidate.load_state_dict(torch.load(MODEL_PATH, map_location=device))
+    candidate.eval()
+    if QUANTIZE:
+        candidate = quantize_for_inference(candidate)
+    return candidate, "eager" + suffix, MODEL_PATH
+
+# Warmup: TorchScript's profiling executor and the allocator settle after a few
+# calls, so the new model is exercised at typical batch sizes BEFORE it goes live.
+WARMUP_ITERATIONS = int(os.getenv("SENTRIA_MODEL_WARMUP_ITERATIONS", "3"))
+
+def warmup_model(candidate):
+    for batch_size in sorted({1, BATCH_MAX_SIZE, PREDICT_CHUNK_SIZE}):
+        features = np.random.rand(batch_size, 10).astype(np.float32)
+        for _ in range(WARMUP_ITERATIONS):
+            forward_batch(features, candidate)
+
+reload_lock = threading.Lock()
+
+def load_model(warmup=True):
+    """
+    Builds, warms up, then atomically swaps in the newest model.
+    In-flight requests keep the reference they already hold and finish on the
+    old model; if loading fails, the old model stays live.
+    Returns True if a new model went live.
+    """
+    global model, model_format, model_version, device
+    with reload_lock:
+        try:
+            if QUANTIZE and INFERENCE_ENGINE != "numpy":
+                # Quantized kernels are CPU-only
+                device = torch.device("cpu")
+
+            candidate, candidate_format, source = build_model()
+            if candidate is None:
+                print(f"⚠️ Model not found at {MODEL_PATH}. Running in Stub Mode.")
+                return False
+
+            started = time.perf_counter()
+            if warmup:
+                warmup_model(candidate)
+            warmup_ms = 1000.0 * (time.perf_counter() - started)
+
+            # Atomic Swap: a single reference assignment. Any cached prediction
+            # belongs to the previous weights, so the cache version moves with it.
+            model, model_format = candidate, candidate_format
+            model_version += 1
+            prediction_cache.clear()
+            print(f"✅ Model Loaded from {source} ({candidate_format}, warmup {warmup_ms:.1f}ms, v{model_version})")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to load model: {e}")
+            return False
+
+def forward_batch(features: np.ndarray, net=None):
+    """
+    Runs ONE forward pass over a (N, 10) float32 feature matrix.
+    Returns per-row numpy arrays: (class_idx, confidence, quantity).
+    `net` defaults to the live model (read once, so a concurrent swap is safe).
+    """
+    net = model if net is None else net
+    if INFERENCE_ENGINE == "numpy":
+        return net.predict(features)
+
+    inputs = torch.from_numpy(features).to(device)
+
+    with torch.inference_mode():
+        out_class, out_qty = net(inputs)
 
-    # 1. Vectorize (Mock Logic for Demo - Production needs ValidationService)
-    # [AgeNorm, Gender, DiagEnc...]
-    features = np.zeros(10, dtype=np.float32) 
-    features[0] = patient.age / 100.0
-    
-    inputs = torch.tensor(features).unsqueeze(0).to(device)
-    
-    with torch.no_grad():
-        out_class, out_qty = model(inputs)
-        
         # Class Prediction
         probs = torch.softmax(out_class, dim=1)
         score, idx = torch.max(probs, 1)
-        
-        # Quantity Prediction
-        qty = out_qty.item()
-        
+
+    return idx.cpu().numpy(), score.cpu().numpy(), out_qty[:, 0].cpu().numpy()
+
+# Checkpoint Watcher
+# Polls the model artifacts and hot-reloads once a changed file has stopped
+# changing for one interval (train.py writes several artifacts in a row).
+MODEL_WATCH_INTERVAL = float(os.getenv("SENTRIA_MODEL_WATCH_INTERVAL", "0"))  # seconds, 0 = disabled
+
+def model_artifact_signature():
+    signature = []
+    for path in (MODEL_PATH, TORCHSCRIPT_PATH, QUANTIZED_TORCHSCRIPT_PATH, WEIGHTS_JSON_PATH):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+async def watch_model_artifacts():
+    live_signature = model_artifact_signature()
+    pending_signature = None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        current = model_artifact_signature()
+        if current == live_signature:
+            pending_signature = None
+            continue
+        if current != pending_signature:
+            # Still being written; wait for it to settle
+            pending_signature = current
+            continue
+
+        print("🔄 New model artifact detected. Hot reloading...")
+        # Load & warm up off the event loop so live traffic is not blocked
+        await asyncio.to_thread(load_model)
+        live_signature, pending_signature = current, None
+
+# Pre-Fork Reload Fan-Out
+# Under backend.prefork each worker holds its own copy of the model, so a reload
+# must reach all of them: /admin/model/reload sends SIGHUP to the master, which
+# forwards it to every worker (and refreshes its own copy for future forks).
+prefork_master_pid = None  # set by backend.prefork in the master, before forking
+MODEL_RELOAD_TIMEOUT = float(os.getenv("SENTRIA_MODEL_RELOAD_TIMEOUT", "120"))  # seconds
+reload_waiters = []  # /admin/model/reload calls waiting for this worker's next reload
+
+async def reload_from_master():
+    # Only requests that were waiting BEFORE this reload started are answered by it
+    waiters = reload_waiters[:]
+    reload_waiters.clear()
+    loaded = await asyncio.to_thread(load_model)
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(loaded)
+
+def install_prefork_reload_handler():
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(reload_from_master()))
+    # The master forks workers with SIGHUP blocked: deliver any reload that
+    # arrived while this worker was still starting up
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGHUP})
+
+async def request_prefork_reload():
+    """
+    Asks the pre-fork master to reload every worker, then waits for this
+    worker's own reload. Returns True if the new model went live here.
+    """
+    waiter = asyncio.get_running_loop().create_future()
+    reload_waiters.append(waiter)
+    os.kill(prefork_master_pid, signal.SIGHUP)
+    return await asyncio.wait_for(waiter, MODEL_RELOAD_TIMEOUT)
+
+# Dynamic Micro-Batching
+# Concurrent /predict calls are grouped into one forward pass.
+# Tune with GET /predict/stats (batch size histogram & queue depth).
+BATCH_MAX_SIZE = int(os.getenv("SENTRIA_BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("SENTRIA_BATCH_MAX_WAIT_MS", "2"))
+
+# Inference Worker Pool & Backpressure
+# Vectorization and forward passes run on a dedicated, size-bounded pool so the
+# event loop keeps serving /health, /memory/* and /logistics/*. When the queue
+# is full, requests get a fast 503 + Retry-After instead of unbounded latency.
+INFERENCE_WORKERS = int(os.getenv("SENTRIA_INFERENCE_WORKERS", "2"))
+INFERENCE_MAX_PENDING = int(os.getenv("SENTRIA_INFERENCE_MAX_PENDING", "8"))  # jobs running + waiting in the pool
+BATCH_MAX_QUEUE = int(os.getenv("SENTRIA_BATCH_MAX_QUEUE", "1024"))  # /predict rows waiting for a batch
+RETRY_AFTER_SECONDS = int(os.getenv("SENTRIA_RETRY_AFTER_SECONDS", "1"))
+
+inference_executor = BoundedExecutor(max_workers=INFERENCE_WORKERS, max_pending=INFERENCE_MAX_PENDING)
+batcher = InferenceBatcher(
+    forward_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    executor=inference_executor,
+    max_queue_depth=BATCH_MAX_QUEUE,
+)
+
+def overloaded(e: InferenceOverloaded):
+    return HTTPException(status_code=503, detail=f"Inference capacity exceeded: {e}", headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+model_watcher = None
+
+@app.on_event("startup")
+async def startup_event():
+    global model_watcher
+    if model is None:
+        load_model()
+    else:
+        # Preloaded by the pre-fork master (shared copy-on-write): only warm up
+        # this worker's own thread pools, never rebuild or write the weights
+        warmup_model(model)
+        print(f"✅ Using Pre-Forked Shared Model ({model_format}, v{model_version}, pid {os.getpid()})")
+    if prefork_master_pid is not None:
+        install_prefork_reload_handler()
+    audit_writer.start()
+    if MEMORY_MIGRATE_ENABLED:
+        start_memory_migrator()
+    await batcher.start()
+    await shipment_feed.start()
+    print(f"⚡ Inference Batcher Ready (max_batch={BATCH_MAX_SIZE}, max_wait={BATCH_MAX_WAIT_MS}ms, workers={INFERENCE_WORKERS})")
+    if MODEL_WATCH_INTERVAL > 0:
+        model_watcher = asyncio.create_task(watch_model_artifacts())
+        print(f"👀 Watching model artifacts every {MODEL_WATCH_INTERVAL}s for hot reload")
+    print("Sentria AI Server Started.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if model_watcher:
+        model_watcher.cancel()
+    await shipment_feed.stop()
+    await batcher.stop()
+    inference_executor.shutdown()
+    memory_migrator_stop.set()
+    # Drain every queued audit event before the process exits
+    await asyncio.to_thread(audit_writer.stop)
+
+# Feature Vectorizer (shared with train.py): the vocabulary index is built once
+# at import, i.e. before fork under backend.prefork.
+vectorizer = get_vectorizer()
+
+def vectorize_patients(patients: list) -> np.ndarray:
+    """
+    Converts a list of PatientData into one (N, 10) float32 feature matrix.
+    [AgeNorm, Gender, DiagEmbedding x7, DiagKnown]
+    """
+    return vectorizer.vectorize(
+        [patient.age for patient in patients],
+        [patient.gender for patient in patients],
+        [patient.diagnosis for patient in patients],
+    )
+
+def format_prediction(idx, score, qty) -> dict:
     return {
-        "recommended_drug": f"Drug_Class_{idx.item()}", 
+        "recommended_drug": f"Drug_Class_{int(idx)}", 
         "recommended_quantity": int(qty),
-        "confidence": float(score.item()),
+        "confidence": float(score),
         "source": "Python-Backend-Inference-MultiHead"
     }
 
+# Fallback for Demo before Models are trained
+STUB_PREDICTION = {
+    "recommended_drug": "Metformin (Fallback - Model Not Trained)",
+    "confidence": 0.0,
+    "source": "Python-Backend-Stub"
+}
+
+@app.post("/predict")
+async def predict_drug(patient: PatientData):
+    if model is None:
+         return dict(STUB_PREDICTION)
+
+    # 1. Vectorize
+    features = vectorize_patients([patient])[0]
+
+    # 2. Cache Lookup
+    cache_key = prediction_cache_key(features)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        return format_prediction(*cached)
+
+    # 3. Batched Inference (shares a forward pass with concurrent requests, off the event loop)
+    try:
+        idx, score, qty = await batcher.submit(features)
+    except InferenceOverloaded as e:
+        raise overloaded(e)
+    prediction_cache.put(cache_key, (idx, score, qty))
+        
+    return format_prediction(idx, score, qty)
+
+# Bulk Scoring (Nightly Pharmacy Planning)
+# Rows are vectorized into one float32 matrix, scored in fixed-size chunks,
+# and each chunk is streamed back as NDJSON as soon as it finishes.
+PREDICT_CHUNK_SIZE = int(os.getenv("SENTRIA_PREDICT_CHUNK_SIZE", "1024"))
+
+async def iter_patient_records(request: Request):
+    """
+    Yields raw patient records from either a JSON array body or a streamed
+    NDJSON body (Content-Type: application/x-ndjson), one line at a time.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" not in content_type and "jsonlines" not in content_type:
+        try:
+            records = await request.json()
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of patients or an NDJSON body")
+        for record in records:
+            yield record
+        return
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request):
+    """
+    Scores many patients in one request. Accepts a JSON list of PatientData
+    or an NDJSON stream, and streams NDJSON results back (one line per input
+    row, in input order). Invalid rows get an "error" line instead.
+    """
+    # Backpressure: refuse new bulk jobs up front while the pool is saturated
+    if inference_executor.saturated:
+        inference_executor.rejected += 1
+        raise overloaded(InferenceOverloaded(f"{inference_executor.pending} jobs pending"))
+
+    # 1. Ingest: vectorize incrementally into one growing float32 matrix
+    matrix = np.zeros((PREDICT_CHUNK_SIZE, 10), dtype=np.float32)
+    errors = {}
+    pending = []
+    count = 0
+
+    async def flush_pending():
+        nonlocal matrix
+        start = count - len(pending)
+        if count > len(matrix):
+            grown = np.zeros((max(count, 2 * len(matrix)), 10), dtype=np.float32)
+            grown[:start] = matrix[:start]
+            matrix = grown
+        matrix[start:count] = await inference_executor.run(vectorize_patients, list(pending), block=True)
+        pending.clear()
+
+    async for record in iter_patient_records(request):
+        try:
+            if isinstance(record, bytes):
+                record = json.loads(record)
+            patient = PatientData(**record)
+        except Exception as e:
+            errors[count] = str(e)
+            patient = None
+
+        # Invalid rows keep an all-zero feature row so indices stay aligned
+        pending.append(patient or PatientData(age=0, gender="", diagnosis="", vitals={}))
+        count += 1
+        if len(pending) == PREDICT_CHUNK_SIZE:
+            await flush_pending()
+    if pending:
+        await flush_pending()
+
+    # 2. Score & Stream: one forward pass per chunk, all on the same model version
+    net = model
+
+    def score_chunk(start, end):
+        if net is not None:
+            idx, score, qty = forward_batch(matrix[start:end], net)
+
+        lines = []
+        for row in range(start, end):
+            if row in errors:
+                result = {"error": errors[row]}
+            elif net is not None:
+                result = format_prediction(idx[row - start], score[row - start], qty[row - start])
+            else:
+                result = dict(STUB_PREDICTION)
+            lines.append(json.dumps({"index": row, **result}))
+        return "\n".join(lines) + "\n"
+
+    async def stream_results():
+        for start in range(0, count, PREDICT_CHUNK_SIZE):
+            end = min(start + PREDICT_CHUNK_SIZE, count)
+            yield await inference_executor.run(score_chunk, start, end, block=True)
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/predict/stats")
+def predict_stats():
+    """
+    Micro-batching metrics for tuning SENTRIA_BATCH_MAX_SIZE / SENTRIA_BATCH_MAX_WAIT_MS,
+    plus prediction cache hit/miss counters.
+    """
+    return {**batcher.stats(), "executor": inference_executor.stats(), "cache": prediction_cache.stats()}
+
 @app.get("/health")
 def health_check():
-    return {"status": "active", "device": str(device)}
+    status = {"status": "active", "device": str(device), "engine": INFERENCE_ENGINE, "model_format": model_format, "model_version": model_version, "pid": os.getpid()}
+    if INFERENCE_ENGINE != "numpy":
+        status["torch_threads"] = torch.get_num_threads()
+    return status
+
+@app.post("/admin/model/reload")
+async def reload_model(request: Request):
+    """
+    Hot-reloads the model from disk (no server restart). The new weights are
+    loaded and warmed up in the background, then swapped in atomically.
+    Under backend.prefork the reload is fanned out to every worker.
+    """
+    if prefork_master_pid is not None:
+        try:
+            loaded = await request_prefork_reload()
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Model reload still in progress")
+    else:
+        loaded = await asyncio.to_thread(load_model)
+    # Strict audit mode commits (fsyncs) inline: keep it off the event loop
+    await asyncio.to_thread(log_audit, request.client.host, "MODEL_RELOAD", model_format or "none",
+                            "SUCCESS" if loaded else "FAILURE")
+    if not loaded:
+        raise HTTPException(status_code=500, detail="Model reload failed; previous model is still live")
+    return {"status": "reloaded", "model_format": model_format, "model_version": model_version}
 
 # RLHF: Doctor Feedback Endpoint
 class FeedbackData(BaseModel):
@@ -115,38 +549,64 @@ def log_feedback(feedback: FeedbackData):
 # 2. AUDIT: All access (Read/Write/Delete) is logged to an immutable ledger.
 # 3. STORAGE: SQLite is used as the high-reliability local store.
 
-import sqlite3
-import json
-from cryptography.fernet import Fernet
-from fastapi import Request
+import contextlib
+import hashlib
+from backend.db import SQLitePool
+from backend.audit import AuditTimeout, AuditWriter
+from backend import envelope
+from backend.keystore import KeyRing
+from backend.logistics import LOGISTICS_INDEXES, InvalidCursor, insert_orders, new_order_ids, page_shipments
+from backend.changefeed import CHANGES_SCHEMA, ChangeFeed
+
+try:
+    import fcntl  # POSIX file locks for multi-worker startup
+except ImportError:
+    fcntl = None
 
 # Database file location
 # NOTE: In production, ensure this directory has strict OS-level permissions (chmod 600).
 DB_PATH = "backend/sentria.db"
 
-# Security: Load Key from Env or Generate New one (Stub logic for demo)
-# CRITICAL: The data security relies entirely on the secrecy of this key.
-# In a real Epic deployment, this key must be injected via a secure Vault (AES/KMS).
+# Shared connection pool: one tuned WAL connection per worker thread,
+# reused by the memory, audit and logistics code paths.
+db_pool = SQLitePool(DB_PATH)
+
+# Security: Load Keys from File or Generate a New one (Stub logic for demo)
+# CRITICAL: The data security relies entirely on the secrecy of these keys.
+# In a real Epic deployment, keys must be injected via a secure Vault (AES/KMS).
+# The file holds one key per line, newest first (see backend/keystore.py):
+# encrypt with the newest, decrypt with any.
 KEY_FILE = "backend/secret.key"
 
-def load_or_create_key():
+# Multi-Worker Safety: import-time setup (key creation, schema init) takes an
+# exclusive file lock, so concurrently starting workers never race each other.
+# (`python -m backend.prefork` runs it exactly once, in the master, before forking.)
+INIT_LOCK_FILE = "backend/sentria.init.lock"
+
+@contextlib.contextmanager
+def init_lock():
+    if fcntl is None:
+        yield
+        return
+    with open(INIT_LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Initialize the Key Ring (creates a robust 32-byte URL-safe base64-encoded key if none exists)
+key_ring = KeyRing(KEY_FILE, lock=init_lock)
+
+def memory_version(blob) -> str:
     """
-    Retrieves the AES encryption key.
-    If no key exists, it generates a robust 32-byte URL-safe base64-encoded key.
+    Content version of a stored row (served as its ETag). Derived from the
+    ciphertext, never the plaintext, so it reveals nothing about the value;
+    Fernet's fresh IV makes it change on every write.
     """
-    if os.path.exists(KEY_FILE):
-        return open(KEY_FILE, "rb").read()
-    else:
-        # Generate new AES-256 compatible key
-        key = Fernet.generate_key()
-        # Persist locally (DEV MODE ONLY - Production should use Vault)
-        with open(KEY_FILE, "wb") as key_file:
-            key_file.write(key)
-        print(f"🔐 Generated new AES-256 Encryption Key at {KEY_FILE}")
-        return key
-
-# Initialize the Cipher Suite with the secure key
-CIPHER_SUITE = Fernet(load_or_create_key())
+    if isinstance(blob, str):
+        blob = blob.encode('utf-8')
+    return hashlib.sha256(blob).hexdigest()[:32]
 
 def init_db():
     """
@@ -154,58 +614,325 @@ def init_db():
     Ensures that the 'memory' and 'audit_log' tables exist.
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with db_pool.transaction() as conn:
+            cursor = conn.cursor()
         
-        # 1. Memory Table (Encrypted Store)
-        # Stores arbitrary JSON data blobs. The 'value' column is NEVER plaintext.
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS memory (
-                key TEXT PRIMARY KEY,
-                value TEXT, -- AES Encrypted Blob (Unreadable without KEY)
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # 2. Audit Trail Table (Immutable Security Log)
-        # Tracks the 'Chain of Custody' for data access. 
-        # Requirement for HIPAA Security Rule 164.312(b).
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS audit_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                user_ip TEXT,    -- Origin IP address
-                action TEXT,     -- READ / WRITE / DELETE
-                resource TEXT,   -- The ID of the data accessed
-                status TEXT      -- SUCCESS / FAILURE
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
+            # 1. Memory Table (Encrypted Store)
+            # Stores arbitrary JSON data blobs. The 'value' column is NEVER plaintext.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS memory (
+                    key TEXT PRIMARY KEY,
+                    value BLOB, -- AES Encrypted Envelope (Unreadable without KEY), see backend/envelope.py
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    version TEXT, -- Content version (ETag), see memory_version()
+                    key_id TEXT -- Fingerprint of the key that encrypted the value
+                )
+            ''')
+
+            # Migration: older databases predate the version column
+            columns = {column[1] for column in cursor.execute('PRAGMA table_info(memory)')}
+            if 'version' not in columns:
+                cursor.execute('ALTER TABLE memory ADD COLUMN version TEXT')
+            stale = cursor.execute('SELECT key, value FROM memory WHERE version IS NULL AND value IS NOT NULL').fetchall()
+            cursor.executemany('UPDATE memory SET version = ? WHERE key = ?',
+                               [(memory_version(value), key) for key, value in stale])
+            if 'key_id' not in columns:
+                cursor.execute('ALTER TABLE memory ADD COLUMN key_id TEXT')
+            if len(key_ring.keys) == 1:
+                # Single-key ring: every existing row is encrypted with it
+                cursor.execute('UPDATE memory SET key_id = ? WHERE key_id IS NULL', (key_ring.primary_id,))
+
+            # Checkpoints for resumable background jobs (re-encryption)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS memory_maintenance (
+                    job TEXT PRIMARY KEY,
+                    target_key_id TEXT,
+                    last_key TEXT,
+                    rewritten INTEGER DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Covering index: conditional GETs are answered from the index alone,
+            # without reading (or decrypting) the encrypted blob
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_key_version ON memory (key, version)')
+
+            # 2. Audit Trail Table (Immutable Security Log)
+            # Tracks the 'Chain of Custody' for data access. 
+            # Requirement for HIPAA Security Rule 164.312(b).
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS audit_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    user_ip TEXT,    -- Origin IP address
+                    action TEXT,     -- READ / WRITE / DELETE
+                    resource TEXT,   -- The ID of the data accessed
+                    status TEXT      -- SUCCESS / FAILURE
+                )
+            ''')
         print(f"🧠 Secure System Memory (SQLite) & Audit Log initialized at {DB_PATH}")
     except Exception as e:
         print(f"❌ Failed to init DB: {e}")
 
-init_db()
+with init_lock():
+    init_db()
+
+# Group-Commit Audit Writer: events are batched into one transaction per flush.
+# SENTRIA_AUDIT_MODE=strict (default) still waits for the commit before the
+# request is acknowledged (503 if it cannot commit in time); =async returns
+# immediately (see backend/audit.py).
+audit_writer = AuditWriter(db_pool)
+
+def audit_unavailable(e: AuditTimeout):
+    # Strict mode: never acknowledge a request whose audit row is not committed
+    return HTTPException(status_code=503, detail=f"Audit log unavailable: {e}", headers={"Retry-After": "1"})
 
 def log_audit(ip: str, action: str, resource: str, status: str):
     """
     Records significant events for Epic Compliance (HIPAA Audit Trail).
     This function acts as a 'Black Box' recorder for the system.
+    Raises a 503 HTTPException if strict mode could not commit the event in time.
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO audit_log (user_ip, action, resource, status) VALUES (?, ?, ?, ?)', 
-                       (ip, action, resource, status))
-        conn.commit()
-        conn.close()
+        audit_writer.record(ip, action, resource, status)
+    except AuditTimeout as e:
+        raise audit_unavailable(e)
     except Exception as e:
         # If audit logging fails, we print to stderr but don't crash the app
         # In strict mode, this should perhaps raise an alert.
         print(f"⚠️ Audit Log Failed: {e}")
 
+def log_audit_batch(ip: str, events: list):
+    """
+    Records one request's (action, resource, status) events together: one row
+    per key, but a single enqueue and (in strict mode) a single commit wait.
+    """
+    try:
+        audit_writer.record_many(ip, events)
+    except AuditTimeout as e:
+        raise audit_unavailable(e)
+    except Exception as e:
+        print(f"⚠️ Audit Log Failed ({len(events)} events): {e}")
+
+def encrypt_memory_value(value: dict):
+    """
+    JSON -> compress (large values only) -> encrypt with the primary key.
+    Returns (envelope bytes for the BLOB column, id of the key used).
+    """
+    cipher, primary_id = key_ring.current_key()
+    return envelope.seal(cipher, value), primary_id
+
+def decrypt_memory_value(blob) -> dict:
+    # Accepts both envelope BLOBs and legacy base64 TEXT tokens, under any key on the ring
+    return key_ring.decrypt_with_retry(lambda cipher: envelope.unseal(cipher, blob))
+
+# Decrypted-Value Cache
+# Hot keys skip Fernet decryption + JSON parsing (the row itself is still read
+# and every read is still audited). An entry is only served while the row's
+# version column matches, so writes from OTHER workers invalidate it too.
+# Strict-HIPAA deployments (no plaintext PHI held in process memory between
+# requests) set SENTRIA_MEMORY_CACHE=0.
+MEMORY_CACHE_ENABLED = os.getenv("SENTRIA_MEMORY_CACHE", "1") != "0"
+MEMORY_CACHE_SIZE = int(os.getenv("SENTRIA_MEMORY_CACHE_SIZE", "1024"))
+MEMORY_CACHE_TTL = float(os.getenv("SENTRIA_MEMORY_CACHE_TTL", "300"))
+memory_cache = TTLCache(MEMORY_CACHE_SIZE if MEMORY_CACHE_ENABLED else 0, MEMORY_CACHE_TTL)
+
+def read_memory_value(key: str, blob: str, version: str) -> dict:
+    """
+    Returns the decrypted value for a row, from the cache when its version still matches.
+    """
+    cached = memory_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    data = decrypt_memory_value(blob)
+    memory_cache.put(key, (version, data))
+    return data
+
+MEMORY_UPSERT_SQL = '''
+    INSERT INTO memory (key, value, version, key_id, updated_at) 
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(key) DO UPDATE SET value=excluded.value, version=excluded.version, key_id=excluded.key_id, updated_at=CURRENT_TIMESTAMP
+'''
+
+def etag_for(version: str) -> str:
+    return f'"{version}"'
+
+def etag_matches(if_none_match: str, version: str) -> bool:
+    """
+    RFC 7232 weak comparison against an If-None-Match header (list, W/ or *).
+    """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == version:
+            return True
+    return False
+
+@app.get("/admin/audit/stats")
+def audit_stats():
+    """
+    Audit pipeline metrics: queue depth, batch sizes and flush latency.
+    """
+    return audit_writer.stats()
+
+@app.get("/admin/memory/stats")
+def memory_stats():
+    """
+    Decrypted-value cache hit/miss counters, key ring and re-encryption progress.
+    """
+    return {
+        **memory_cache.stats(),
+        "primary_key_id": key_ring.primary_id,
+        "key_ids": key_ring.key_ids,
+        "reencryption": memory_migration_stats,
+    }
+
+# Background Re-Encryption (envelope migration + key rotation)
+# One job keeps every row on the current envelope format AND the current
+# primary key: legacy base64 TEXT rows are rewritten as envelope BLOBs, and
+# rows still encrypted under an older key are re-encrypted. It walks the table
+# by primary key (keyset pagination) in bounded transactions and stores its
+# position in the same transaction, so a restart resumes from the checkpoint.
+# It throttles itself to a duty cycle (default: busy 10% of the time), so live
+# traffic keeps its throughput. A row is only replaced if it is unchanged since
+# it was read, and its version (ETag) is kept: the plaintext is the same, so
+# clients and the decrypted-value cache stay valid.
+# One worker runs it at a time (file lock election).
+MEMORY_MIGRATE_ENABLED = os.getenv("SENTRIA_MEMORY_MIGRATE", "1") != "0"
+MEMORY_MIGRATE_BATCH = int(os.getenv("SENTRIA_MEMORY_MIGRATE_BATCH", "200"))
+MEMORY_MIGRATE_DUTY = float(os.getenv("SENTRIA_MEMORY_MIGRATE_DUTY", "0.1"))
+MIGRATE_LOCK_FILE = "backend/sentria.migrate.lock"
+memory_migrator_stop = threading.Event()
+memory_migrator_thread = None
+memory_migration_stats = {"running": False, "target_key_id": None, "last_key": None, "rewritten": 0, "skipped": 0, "batches": 0}
+
+def reencrypt_memory_rows(batch_size=MEMORY_MIGRATE_BATCH, duty=MEMORY_MIGRATE_DUTY, stop=memory_migrator_stop):
+    """
+    Moves every row onto the envelope format + primary key. Returns True when complete.
+    """
+    stats = memory_migration_stats
+    cipher, target = key_ring.current_key()
+    cursor = db_pool.connection().cursor()
+
+    last_key, rewritten, skipped = "", 0, 0
+    checkpoint = cursor.execute(
+        "SELECT target_key_id, last_key, rewritten FROM memory_maintenance WHERE job = 'reencrypt'"
+    ).fetchone()
+    if checkpoint and checkpoint[0] == target:
+        last_key, rewritten = checkpoint[1] or "", checkpoint[2] or 0
+        print(f"📦 Resuming memory re-encryption to key {target} after {last_key!r} ({rewritten} rows done)")
+    stats.update(target_key_id=target, last_key=last_key, rewritten=rewritten, skipped=0)
+
+    while not stop.is_set():
+        # Rotated again mid-run: restart the walk towards the new primary key
+        if key_ring.current_key()[1] != target:
+            cipher, target = key_ring.current_key()
+            last_key = ""
+            stats["target_key_id"] = target
+
+        started = time.perf_counter()
+        cursor.execute(
+            "SELECT key, value FROM memory WHERE key > ? AND (key_id IS NOT ? OR typeof(value) = 'text') ORDER BY key LIMIT ?",
+            (last_key, target, batch_size),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            with db_pool.transaction() as conn:
+                conn.execute("DELETE FROM memory_maintenance WHERE job = 'reencrypt'")
+            if rewritten or skipped:
+                print(f"📦 Memory re-encryption complete: {rewritten} rows on key {target}, {skipped} skipped")
+            return True
+        last_key = rows[-1][0]
+
+        updates = []
+        for key, stored in rows:
+            try:
+                updates.append((envelope.seal(cipher, decrypt_memory_value(stored)), target, key, stored))
+            except Exception as e:
+                skipped += 1
+                print(f"⚠️ Memory re-encryption skipped {key}: {e}")
+
+        with db_pool.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany('UPDATE memory SET value = ?, key_id = ? WHERE key = ? AND value = ?', updates)
+            rewritten += conn.total_changes - before
+            conn.execute('''
+                INSERT INTO memory_maintenance (job, target_key_id, last_key, rewritten, updated_at)
+                VALUES ('reencrypt', ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(job) DO UPDATE SET target_key_id=excluded.target_key_id, last_key=excluded.last_key,
+                    rewritten=excluded.rewritten, updated_at=CURRENT_TIMESTAMP
+            ''', (target, last_key, rewritten))
+
+        stats.update(last_key=last_key, rewritten=rewritten, skipped=skipped, batches=stats["batches"] + 1)
+        # Duty-cycle throttle: sleep long enough that this job uses at most `duty` of the time
+        busy = time.perf_counter() - started
+        stop.wait(max(0.001, busy * (1.0 - duty) / duty))
+    return False
+
+def run_memory_migrator():
+    if fcntl is None:
+        lock_file = None
+    else:
+        lock_file = open(MIGRATE_LOCK_FILE, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return  # another worker is migrating
+    memory_migration_stats["running"] = True
+    try:
+        reencrypt_memory_rows()
+    except Exception as e:
+        print(f"❌ Memory re-encryption failed (resumes from checkpoint on next start): {e}")
+    finally:
+        memory_migration_stats["running"] = False
+        if lock_file is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+def start_memory_migrator():
+    global memory_migrator_thread
+    if memory_migrator_thread is not None and memory_migrator_thread.is_alive():
+        return
+    memory_migrator_stop.clear()
+    memory_migrator_thread = threading.Thread(target=run_memory_migrator, name="sentria-memory-migrator", daemon=True)
+    memory_migrator_thread.start()
+
+@app.post("/admin/memory/rotate-key")
+def rotate_memory_key(request: Request):
+    """
+    Online key rotation: adds a new primary key (all workers pick it up) and
+    starts re-encrypting existing rows in the background. Reads and writes
+    keep working throughout; rows not yet re-encrypted decrypt with the old key.
+    """
+    try:
+        primary_id = key_ring.rotate()
+    except Exception as e:
+        log_audit(request.client.host, "KEY_ROTATE", "memory", f"FAILURE: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    log_audit(request.client.host, "KEY_ROTATE", primary_id, "SUCCESS")
+    start_memory_migrator()
+    return {"status": "rotating", "primary_key_id": primary_id, "key_ids": key_ring.key_ids}
+
+@app.post("/admin/memory/retire-keys")
+def retire_memory_keys(request: Request):
+    """
+    Drops old keys from the ring once no row is encrypted with them anymore.
+    """
+    cursor = db_pool.connection().cursor()
+    remaining = cursor.execute(
+        "SELECT COUNT(*) FROM memory WHERE key_id IS NOT ? OR typeof(value) = 'text'", (key_ring.primary_id,)
+    ).fetchone()[0]
+    if remaining:
+        raise HTTPException(status_code=409, detail=f"{remaining} rows still use an older key; re-encryption is not finished")
+    key_ids = key_ring.retire()
+    log_audit(request.client.host, "KEY_RETIRE", key_ring.primary_id, "SUCCESS")
+    return {"status": "retired", "key_ids": key_ids}
+
 class MemoryItem(BaseModel):
     key: str
     value: dict 
@@ -223,28 +950,23 @@ def set_memory(item: MemoryItem, request: Request):
     5. Log the write action to Audit Trail.
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 1. Encrypt Data (AES-256)
-        # We encode to bytes, encrypt, then decode back to string for storage
-        raw_json = json.dumps(item.value).encode('utf-8')
-        encrypted_blob = CIPHER_SUITE.encrypt(raw_json).decode('utf-8')
-
-        # 2. Store Encrypted Data (UPSERT strategy)
-        cursor.execute('''
-            INSERT INTO memory (key, value, updated_at) 
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=CURRENT_TIMESTAMP
-        ''', (item.key, encrypted_blob))
+        with db_pool.transaction() as conn:
+            cursor = conn.cursor()
         
-        conn.commit()
-        conn.close()
+            # 1. Encrypt Data (AES-256)
+            encrypted_blob, key_id = encrypt_memory_value(item.value)
+
+            # 2. Store Encrypted Data (UPSERT strategy)
+            version = memory_version(encrypted_blob)
+            cursor.execute(MEMORY_UPSERT_SQL, (item.key, encrypted_blob, version, key_id))
+        memory_cache.pop(item.key)
 
         # 3. Log Audit
         log_audit(request.client.host, "WRITE", item.key, "SUCCESS")
         
-        return {"status": "success", "key": item.key, "encryption": "AES-256-GCM"}
+        return {"status": "success", "key": item.key, "encryption": "AES-256-GCM", "etag": etag_for(version)}
+    except HTTPException:
+        raise
     except Exception as e:
         # Failure Logging
         log_audit(request.client.host, "WRITE", item.key, f"FAILURE: {str(e)}")
@@ -259,49 +981,59 @@ def init_logistics_db():
     Initializes the Logistics tables (Orders, Shipments).
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with db_pool.transaction() as conn:
+            cursor = conn.cursor()
         
-        # 1. Orders Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id TEXT PRIMARY KEY,
-                user_id TEXT,
-                total_amount REAL,
-                status TEXT, -- pending, processing, shipped, complete
-                items TEXT,  -- JSON blob of cart items
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # 2. Shipments Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS shipments (
-                id TEXT PRIMARY KEY,
-                order_id TEXT,
-                tracking_number TEXT,
-                provider TEXT,
-                status TEXT, -- scheduled, in_transit, delivered
-                estimated_delivery TIMESTAMP,
-                origin TEXT,
-                destination TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
+            # 1. Orders Table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS orders (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    total_amount REAL,
+                    status TEXT, -- pending, processing, shipped, complete
+                    items TEXT,  -- JSON blob of cart items
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 2. Shipments Table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS shipments (
+                    id TEXT PRIMARY KEY,
+                    order_id TEXT,
+                    tracking_number TEXT,
+                    provider TEXT,
+                    status TEXT, -- scheduled, in_transit, delivered
+                    estimated_delivery TIMESTAMP,
+                    origin TEXT,
+                    destination TEXT,
+                    region TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # 3. Migration: region column (older databases) + lookup/filter indexes
+            columns = {column[1] for column in cursor.execute('PRAGMA table_info(shipments)')}
+            if 'region' not in columns:
+                cursor.execute('ALTER TABLE shipments ADD COLUMN region TEXT')
+            for statement in LOGISTICS_INDEXES:
+                cursor.execute(statement)
+
+            # 4. Change Feed (shipment inserts / status deltas, see backend/changefeed.py)
+            cursor.execute(CHANGES_SCHEMA)
         print(f"🚚 Logistics Module initialized.")
     except Exception as e:
         print(f"❌ Failed to init Logistics DB: {e}")
 
-init_logistics_db()
+with init_lock():
+    init_logistics_db()
 
 class OrderCallback(BaseModel):
     user_id: str
     items: list
     total: float
     shipping_method: str
+    region: Optional[str] = None
 
 @app.post("/logistics/order")
 def create_order(order: OrderCallback, request: Request):
@@ -309,33 +1041,35 @@ def create_order(order: OrderCallback, request: Request):
     Creates a new Order and automatically schedules a Shipment.
     Real "Business Logic" in action.
     """
-    import uuid
     import datetime
     
-    order_id = f"ORD-{uuid.uuid4().hex[:8].upper()}"
-    shipment_id = f"SHP-{uuid.uuid4().hex[:8].upper()}"
-    tracking_num = f"1Z{uuid.uuid4().hex[:10].upper()}"
+    order_id, shipment_id, tracking_num = new_order_ids()
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 1. Create Order
-        cursor.execute('''
-            INSERT INTO orders (id, user_id, total_amount, status, items)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (order_id, order.user_id, order.total, "processing", json.dumps(order.items)))
+        with db_pool.transaction() as conn:
+            cursor = conn.cursor()
         
-        # 2. Create Shipment (Simulating "Cold Chain Express" logic)
-        eta = datetime.datetime.now() + datetime.timedelta(days=1) # Next day delivery
+            # 1. Create Order
+            cursor.execute('''
+                INSERT INTO orders (id, user_id, total_amount, status, items)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (order_id, order.user_id, order.total, "processing", json.dumps(order.items)))
         
-        cursor.execute('''
-            INSERT INTO shipments (id, order_id, tracking_number, provider, status, estimated_delivery, origin, destination)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (shipment_id, order_id, tracking_num, "ColdChainAES", "scheduled", eta, "Central Hub", "User Location"))
+            # 2. Create Shipment (Simulating "Cold Chain Express" logic)
+            eta = datetime.datetime.now() + datetime.timedelta(days=1) # Next day delivery
         
-        conn.commit()
-        conn.close()
+            cursor.execute('''
+                INSERT INTO shipments (id, order_id, tracking_number, provider, status, estimated_delivery, origin, destination, region)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (shipment_id, order_id, tracking_num, "ColdChainAES", "scheduled", eta, "Central Hub", "User Location", order.region))
+
+            # 3. Publish to the change feed (same transaction)
+            ChangeFeed.record(conn, shipment_id, "insert", {
+                "id": shipment_id, "order_id": order_id, "tracking_number": tracking_num, "provider": "ColdChainAES",
+                "status": "scheduled", "estimated_delivery": eta, "origin": "Central Hub",
+                "destination": "User Location", "region": order.region,
+            })
+        shipment_feed.notify()
         
         log_audit(request.client.host, "ORDER", order_id, "CREATED")
         
@@ -346,18 +1080,119 @@ def create_order(order: OrderCallback, request: Request):
             "tracking_number": tracking_num,
             "eta": eta.isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         log_audit(request.client.host, "ORDER", "NEW", f"FAILURE: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+ORDER_BATCH_MAX = int(os.getenv("SENTRIA_ORDER_BATCH_MAX", "5000"))
+
+class OrderBatch(BaseModel):
+    orders: list[OrderCallback]
+
+@app.post("/logistics/orders/bulk")
+def create_orders_bulk(batch: OrderBatch, request: Request):
+    """
+    Group-purchasing ingestion: creates every order + shipment in ONE
+    transaction (two executemany calls) and audits the batch as one entry.
+    All-or-nothing: if any insert fails, nothing is created.
+    """
+    import uuid
+
+    count = len(batch.orders)
+    if count == 0:
+        return {"status": "success", "count": 0, "orders": []}
+    if count > ORDER_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({count} orders, max {ORDER_BATCH_MAX})")
+
+    batch_id = f"BATCH-{uuid.uuid4().hex[:8].upper()}"
+    try:
+        with db_pool.transaction() as conn:
+            results, changes = insert_orders(conn, [order.model_dump() for order in batch.orders])
+            ChangeFeed.record_many(conn, changes)
+    except Exception as e:
+        log_audit(request.client.host, "ORDER_BATCH", batch_id, f"FAILURE ({count} orders): {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    shipment_feed.notify()
+
+    # One audit row for the whole batch (instead of one per order), still naming every order
+    log_audit(request.client.host, "ORDER_BATCH", f"{batch_id}:" + ",".join(result["order_id"] for result in results),
+              f"CREATED ({count} orders)")
+    return {"status": "success", "batch_id": batch_id, "count": count, "orders": results}
+
+# Change Feed: one broadcaster per worker fans shipment changes out to every
+# connected map (replaces N clients re-polling /logistics/network).
+CHANGEFEED_HEARTBEAT_S = float(os.getenv("SENTRIA_CHANGEFEED_HEARTBEAT_S", "15"))
+shipment_feed = ChangeFeed(db_pool)
+
+class ShipmentStatusUpdate(BaseModel):
+    status: str
+
+@app.post("/logistics/tracking/{tracking_number}/status")
+def update_shipment_status(tracking_number: str, update: ShipmentStatusUpdate, request: Request):
+    """
+    Carrier status update (scheduled -> in_transit -> delivered). Published to the change feed.
+    """
+    try:
+        with db_pool.transaction() as conn:
+            row = conn.execute("SELECT id, status FROM shipments WHERE tracking_number=?", (tracking_number,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Tracking number not found")
+            shipment_id, previous = row
+            if previous != update.status:
+                conn.execute("UPDATE shipments SET status=?, updated_at=CURRENT_TIMESTAMP WHERE id=?", (update.status, shipment_id))
+                ChangeFeed.record(conn, shipment_id, "status", {
+                    "tracking_number": tracking_number, "status": update.status, "previous_status": previous,
+                })
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_audit(request.client.host, "SHIPMENT_STATUS", tracking_number, f"FAILURE: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    shipment_feed.notify()
+    log_audit(request.client.host, "SHIPMENT_STATUS", shipment_id, update.status.upper())
+    return {"status": "updated", "shipment_id": shipment_id, "shipment_status": update.status}
+
+@app.get("/logistics/changes")
+async def shipment_changes(request: Request, since: Optional[int] = None):
+    """
+    Server-Sent Events stream of shipment changes (`event: shipment`, `id:` = sequence number).
+
+    Resume with `?since=<seq>` or the standard `Last-Event-ID` header (browsers'
+    EventSource sends it automatically on reconnect). If that point is no longer
+    retained, an `event: reset` is sent first: reload /logistics/network, then
+    apply the live changes that follow.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    reset = since is not None and not await asyncio.to_thread(shipment_feed.can_resume, since)
+
+    async def stream_changes():
+        yield "retry: 3000\n\n"
+        if reset:
+            yield f"event: reset\ndata: {json.dumps({'reason': 'history pruned', 'since': since})}\n\n"
+        async for change in shipment_feed.subscribe(None if reset else since, heartbeat=CHANGEFEED_HEARTBEAT_S):
+            if change is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {change['seq']}\nevent: shipment\ndata: {json.dumps(change, default=str)}\n\n"
+
+    return StreamingResponse(stream_changes(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/logistics/changes/stats")
+def shipment_changes_stats():
+    return shipment_feed.stats()
+
 @app.get("/logistics/tracking/{tracking_number}")
 def get_tracking(tracking_number: str):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = db_pool.connection().cursor()
         cursor.execute("SELECT * FROM shipments WHERE tracking_number=?", (tracking_number,))
         row = cursor.fetchone()
-        conn.close()
         
         if not row:
             raise HTTPException(status_code=404, detail="Tracking number not found")
@@ -369,39 +1204,64 @@ def get_tracking(tracking_number: str):
     except Exception as e:
          raise HTTPException(status_code=404, detail="Shipment not found")
 
+NETWORK_PAGE_MAX = int(os.getenv("SENTRIA_NETWORK_PAGE_MAX", "500"))
+
 @app.get("/logistics/network")
-def get_network_activity():
+def get_network_activity(response: Response, status: str = "active", provider: Optional[str] = None,
+                         region: Optional[str] = None, cursor: Optional[str] = None, limit: int = 50):
     """
-    Returns active shipments for the Map visualization.
+    Returns shipments for the Map visualization (default: all not yet delivered).
+
+    Filters: status ("active", "all" or a concrete status), provider, region.
+    Paging: the body stays a plain list; when more rows exist, the
+    `X-Next-Cursor` header carries the token to pass back as `?cursor=`.
     """
+    limit = max(1, min(limit, NETWORK_PAGE_MAX))
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM shipments WHERE status != 'delivered' LIMIT 50")
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        items, next_cursor = page_shipments(db_pool.connection().cursor(), status=status, provider=provider,
+                                            region=region, after=cursor, limit=limit)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        print(f"❌ Network feed query failed: {e}")
         return []
 
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
 @app.get("/memory/get/{key}")
-def get_memory(key: str, request: Request):
+def get_memory(key: str, request: Request, response: Response):
+    """
+    Returns the decrypted JSON value with its ETag.
+
+    Polling clients send the ETag back as If-None-Match: an unchanged key is
+    answered with 304 from the (key, version) index, with no decryption and
+    no body. The read is audited either way.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM memory WHERE key = ?', (key,))
+        cursor = db_pool.connection().cursor()
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            cursor.execute('SELECT version FROM memory INDEXED BY idx_memory_key_version WHERE key = ?', (key,))
+            current = cursor.fetchone()
+            if current and current[0] and etag_matches(if_none_match, current[0]):
+                log_audit(request.client.host, "READ", key, "NOT_MODIFIED")
+                return Response(status_code=304, headers={"ETag": etag_for(current[0]), "Cache-Control": "private, no-cache"})
+
+        cursor.execute('SELECT value, version FROM memory WHERE key = ?', (key,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            # Decrypt Data
+            # Decrypt Data (skipped on a cache hit for the same row version)
             try:
-                decrypted_json = CIPHER_SUITE.decrypt(row[0].encode('utf-8')).decode('utf-8')
-                data = json.loads(decrypted_json)
+                data = read_memory_value(key, row[0], row[1])
                 log_audit(request.client.host, "READ", key, "SUCCESS")
+                response.headers["ETag"] = etag_for(row[1])
+                response.headers["Cache-Control"] = "private, no-cache"
                 return data
+            except HTTPException:
+                raise
             except Exception as decrypt_err:
                  log_audit(request.client.host, "READ", key, "DECRYPTION_FAILURE")
                  print(f"❌ Decryption Failed (Key Mismatch?): {decrypt_err}")
@@ -409,6 +1269,8 @@ def get_memory(key: str, request: Request):
 
         log_audit(request.client.host, "READ", key, "NOT_FOUND")
         return {} 
+    except HTTPException:
+        raise
     except Exception as e:
         log_audit(request.client.host, "READ", key, f"FAILURE: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -416,12 +1278,114 @@ def get_memory(key: str, request: Request):
 @app.post("/memory/clear/{key}")
 def clear_memory(key: str, request: Request):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM memory WHERE key = ?', (key,))
-        conn.commit()
-        conn.close()
+        with db_pool.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM memory WHERE key = ?', (key,))
+        memory_cache.pop(key)
         log_audit(request.client.host, "DELETE", key, "SUCCESS")
         return {"status": "cleared", "key": key}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==========================================
+# BULK MEMORY (mget / mset)
+# ==========================================
+# The frontend rehydrates dozens of keys at once. These endpoints read or
+# upsert the whole batch with one SQL statement / one transaction, encrypt or
+# decrypt it in a single pass, and audit it as one batch (still one row per key).
+
+MEMORY_BATCH_MAX_KEYS = int(os.getenv("SENTRIA_MEMORY_BATCH_MAX_KEYS", "500"))
+SQLITE_MAX_PARAMS = 900  # stay below SQLite's default bound-parameter limit
+
+class MemoryBatchGet(BaseModel):
+    keys: list[str]
+
+class MemoryBatchSet(BaseModel):
+    items: list[MemoryItem]
+
+def check_batch_size(count: int):
+    if count > MEMORY_BATCH_MAX_KEYS:
+        raise HTTPException(status_code=413, detail=f"Batch too large ({count} keys, max {MEMORY_BATCH_MAX_KEYS})")
+
+@app.post("/memory/mget")
+def get_memory_batch(batch: MemoryBatchGet, request: Request):
+    """
+    Bulk read: {"keys": [...]} -> {"results": {key: {"status", "value"}}}.
+    Per-key status is "found", "not_found" or "decryption_failure".
+    """
+    keys = list(dict.fromkeys(batch.keys))  # de-duplicate, keep order
+    check_batch_size(len(keys))
+
+    try:
+        cursor = db_pool.connection().cursor()
+        rows = {}
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f'SELECT key, value, version FROM memory WHERE key IN ({placeholders})', chunk)
+            rows.update((key, (value, version)) for key, value, version in cursor.fetchall())
     except Exception as e:
+        log_audit_batch(request.client.host, [("READ", key, f"FAILURE: {str(e)}") for key in keys])
         raise HTTPException(status_code=500, detail=str(e))
+
+    results = {}
+    events = []
+    for key in keys:
+        row = rows.get(key)
+        if row is None:
+            results[key] = {"status": "not_found", "value": {}}
+            events.append(("READ", key, "NOT_FOUND"))
+            continue
+        try:
+            results[key] = {"status": "found", "value": read_memory_value(key, *row), "etag": etag_for(row[1])}
+            events.append(("READ", key, "SUCCESS"))
+        except Exception as decrypt_err:
+            print(f"❌ Decryption Failed for {key} (Key Mismatch?): {decrypt_err}")
+            results[key] = {"status": "decryption_failure", "value": {}}
+            events.append(("READ", key, "DECRYPTION_FAILURE"))
+
+    log_audit_batch(request.client.host, events)
+    return {"results": results}
+
+@app.post("/memory/mset")
+def set_memory_batch(batch: MemoryBatchSet, request: Request):
+    """
+    Bulk write: {"items": [{"key", "value"}, ...]} -> {"results": {key: status}}.
+
+    Workflow:
+    1. Encrypt every value (a value that cannot be serialized fails only its key).
+    2. UPSERT all encrypted blobs with one executemany in ONE transaction.
+    3. Log the whole batch to the Audit Trail together.
+    """
+    check_batch_size(len(batch.items))
+
+    # 1. Encrypt (last write wins for duplicate keys, like sequential /memory/set calls)
+    results = {}
+    encrypted = {}
+    for item in batch.items:
+        try:
+            blob, key_id = encrypt_memory_value(item.value)
+            encrypted[item.key] = (blob, memory_version(blob), key_id)
+            results[item.key] = "success"
+        except Exception as e:
+            encrypted.pop(item.key, None)
+            results[item.key] = f"failure: {str(e)}"
+
+    # 2. Store
+    try:
+        with db_pool.transaction() as conn:
+            conn.executemany(MEMORY_UPSERT_SQL, [(key, *row) for key, row in encrypted.items()])
+        for key in encrypted:
+            memory_cache.pop(key)
+    except Exception as e:
+        log_audit_batch(request.client.host, [("WRITE", key, f"FAILURE: {str(e)}") for key in results])
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # 3. Log Audit
+    log_audit_batch(request.client.host, [
+        ("WRITE", key, "SUCCESS" if status == "success" else status.replace("failure", "FAILURE", 1))
+        for key, status in results.items()
+    ])
+    return {"results": results, "written": len(encrypted), "encryption": "AES-256-GCM"}
@@ -1,12 +1,19 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
-from model import ClinicalNetwork
+from torch.utils.data import Dataset, DataLoader, Sampler
+from model import ClinicalNetwork, quantize_for_inference
+from numpy_engine import to_weights_list
+from vectorizer import FEATURE_SIZE, get_vectorizer
+from ingest import IngestStats, iter_batches, iter_http_batches, iter_local_batches
+from featurize import FEATURIZE_CHUNK, TARGETS_VERSION, featurize_batches
+from datacache import TRAINING_CACHE_ENABLED, TrainingDataCache, file_sha1
 import os
 import requests
 import json
 import numpy as np
+import sys
+import time
 from dotenv import load_dotenv
 from tqdm import tqdm
 
@@ -20,20 +27,45 @@ load_dotenv(dotenv_path=BASE_DIR / ".env")
 BATCH_SIZE = 64
 EPOCHS = 10
 LEARNING_RATE = 0.001
+# Metrics are read back from the device (a sync) only every N steps and at epoch end
+LOG_EVERY_STEPS = int(os.getenv("SENTRIA_TRAIN_LOG_EVERY", "50"))
+# Opt-in bfloat16 autocast for CPU training (fp32 master weights, losses in fp32)
+TRAIN_BF16 = os.getenv("SENTRIA_TRAIN_BF16", "0") == "1"
 BOX_TOKEN = os.getenv("BOX_DEVELOPER_TOKEN")
+# Local stand-in for the Box archive (.json / .ndjson, optionally .gz) - used instead of Box when set
+TRAINING_DATA_FILE = os.getenv("SENTRIA_TRAINING_DATA_FILE")
+MODEL_PATH = "backend/clinical_model_final.pth"
+TORCHSCRIPT_PATH = "backend/clinical_model_final.torchscript.pt"
+QUANTIZED_TORCHSCRIPT_PATH = "backend/clinical_model_final.int8.torchscript.pt"
+WEIGHTS_JSON_PATH = "backend/clinical_model_final.weights.json"
 
 # --- DATA LOADING ---
 
 class BoxClinicalDataset(Dataset):
     """
-    Fetches data from Box API (or uses local cache) and formats it for PyTorch.
+    Fetches data from Box API (or a local file) and formats it for PyTorch.
+    Records are streamed and featurized in parallel chunks straight into
+    columns (features / classes / quantities). With the training cache on,
+    the columns (and the archive, once read in full) are cached by content
+    hash and reused (memory-mapped) by later runs.
     """
-    def __init__(self, num_samples=1000):
-        self.data = []
+    def __init__(self, num_samples=1000, source=None, cache=TRAINING_CACHE_ENABLED):
+        self.features = self.classes = self.quantities = None
         self.num_samples = num_samples
+        self.vectorizer = get_vectorizer()  # built once here, before the featurize pool forks
+        self.ingest_stats = IngestStats()
+        # cache: True/False, or a TrainingDataCache instance (custom location)
+        self.cache = TrainingDataCache() if cache is True else (cache or None)
         print(f"Initializing Dataset. Target: {num_samples} records.")
         
-        if BOX_TOKEN:
+        source = source or TRAINING_DATA_FILE
+        if source:
+            print(f"📂 Loading training data from local file: {source}")
+            if self.cache:
+                self.load_archive(file_sha1(source), path=source)
+            else:
+                self.ingest(iter_local_batches(source, FEATURIZE_CHUNK, self.ingest_stats))
+        elif BOX_TOKEN:
             try:
                 self.fetch_from_box()
             except Exception as e:
@@ -41,7 +73,19 @@ class BoxClinicalDataset(Dataset):
         else:
             print("⚠️ No Box Token found. Proceeding without live Box data.")
 
+        if self.features is None:
+            self._allocate(0)
+        # Zero-copy tensor views over the columns (also over the cache's mmap)
+        self.tensors = tuple(torch.from_numpy(column) for column in (self.features, self.classes, self.quantities))
+
     def fetch_from_box(self):
+        """
+        Streams the training archive from Box: download, gunzip, parsing and
+        featurization overlap, and reading stops once num_samples records are in.
+        With the training cache on, the stream is also written to the cache as
+        it is read. It is kept (SHA-1 verified) only if the whole archive was
+        read; an early stop keeps just the featurized arrays.
+        """
         # Initialize Box SDK client for user verification
         auth = OAuth2(
             client_id='YOUR_CLIENT_ID', # Client ID and Secret are not strictly needed for developer token authentication
@@ -64,91 +108,117 @@ class BoxClinicalDataset(Dataset):
         headers = {'Authorization': f'Bearer {BOX_TOKEN}'}
         
         try:
-            print(f"⬇️  Downloading compressed data from Box (File ID: {FILE_ID})...")
-            response = requests.get(file_url, headers=headers)
-            
-            if response.status_code == 200:
-                # UNZIP IN MEMORY
-                import gzip
-                import io
-                
-                print("📦 Decompressing GZIP stream...")
-                with gzip.GzipFile(fileobj=io.BytesIO(response.content), mode='rb') as f:
-                    decompressed_data = f.read()
-                    text_data = decompressed_data.decode('utf-8')
-                
-                # Parse the massive JSON blob
-                print(f"📄 Parsing {len(text_data)} bytes of JSON data...")
-                # Assuming the file contains a list of patient records
-                # If it's Newline Delimited JSON, we splitlines. If standard JSON list, json.loads.
-                # We try standard load first.
-                try:
-                    patient_records = json.loads(text_data)
-                except json.JSONDecodeError:
-                    # Fallback for NDJSON
-                    patient_records = [json.loads(line) for line in text_data.splitlines() if line.strip()]
-
-                print(f"✅ Loaded {len(patient_records)} records from Box Archive.")
-                
-                count = 0
-                for record in tqdm(patient_records[:self.num_samples], desc="Processing Records"):
-                    try:
-                        self.process_patient_record(record)
-                        count += 1
-                    except Exception as e:
-                        continue 
-                
-                # Backfill if needed
-                if count < self.num_samples:
-                     print(f"⚠️ Warning: Requested {self.num_samples} records, but only {count} were processed.")
-                     # No backfill, just use what we have
+            if self.cache:
+                # Only the metadata is fetched when this version is already cached
+                info, path = self.cache.box_version(FILE_ID, headers)
+                if path is not None:
+                    self.load_archive(info["sha1"], path=path)
+                    return
+                print(f"⬇️  Streaming compressed data from Box (File ID: {FILE_ID}) into the cache...")
+                with self.cache.box_download(FILE_ID, headers, info) as download:
+                    self.load_archive(info["sha1"], download=download)
+                return
 
-            else:
-                 error_msg = response.text
-                 print(f"⚠️ Box Download Failed ({response.status_code}). Response: {error_msg}")
-                 raise Exception(f"Box API Error: {response.status_code}")
+            print(f"⬇️  Streaming compressed data from Box (File ID: {FILE_ID})...")
+            # Download, gunzip and JSON parsing all happen incrementally (see ingest.py):
+            # peak memory stays flat no matter how large the archive is
+            self.ingest(iter_http_batches(file_url, FEATURIZE_CHUNK, headers=headers, stats=self.ingest_stats))
 
+        except requests.HTTPError as e:
+            error_msg = e.response.text[:500] if e.response is not None else ""
+            print(f"⚠️ Box Download Failed ({e.response.status_code if e.response is not None else '?'}). Response: {error_msg}")
+            raise Exception(f"Box API Error: {e}")
         except Exception as e:
             print(f"❌ Box Interaction Failed: {e}")
             raise e
 
-    def process_patient_record(self, data):
+    def load_archive(self, archive_sha1, path=None, download=None):
         """
-        Converts raw FHIR/JSON from Box into Tensor.
-        Expected format: { "age": 40, "diagnosis": "...", "vitals": ... }
+        Memory-maps the cached arrays for this archive + featurizer, or
+        featurizes the archive (a local file, or a datacache.ArchiveDownload
+        still streaming in) and caches the result.
         """
-        # Feature Extraction logic mirroring the simulation
-        # 1. Age (Normalized)
-        age = data.get('age', 40)
-        age_norm = float(age) / 100.0
-        
-        # 2. Diagnosis (Simple Hashing/Embedding assumption for this demo)
-        # In production, use the same vocab as the simulation
-        diag_str = data.get('diagnosis', 'General')
-        # ... logic to vectorize diag_str ... 
-        # For this implementation, we use random noise mixed with signal to represent 'embeddings'
-        # just to prove the pipeline works, as we don't have the real NLP model loaded here yet.
-        features = np.random.rand(10).astype(np.float32)
-        features[0] = age_norm
-        
-        
-        # Target Class
-        target_class = np.random.randint(0, 50) 
-        
-        # Target Quantity (Simulated correlation with Age/Severity)
-        # e.g., Older patients need more meds, etc.
-        base_qty = 30
-        target_qty = base_qty + (age_norm * 20) + np.random.normal(0, 5)
-        target_qty = max(10, min(180, int(target_qty)))
-        
-        self.data.append((torch.tensor(features), torch.tensor(target_class), torch.tensor(target_qty)))
+        key = self.cache.features_key(archive_sha1, self.num_samples, extra=f"t{TARGETS_VERSION}")
+        cached = self.cache.load_features(key)
+        if cached is not None:
+            self.features, self.classes, self.quantities = cached["features"], cached["classes"], cached["quantities"]
+            print(f"⚡ Loaded {len(self.features)} featurized records from cache ({key}).")
+            return
+
+        if download is None:
+            self.ingest(iter_local_batches(path, FEATURIZE_CHUNK, self.ingest_stats))
+        else:
+            self.ingest(iter_batches(download, FEATURIZE_CHUNK, self.ingest_stats))
+            if len(self.features) < self.num_samples:
+                # The whole archive was read: keep it for runs with other sample counts
+                try:
+                    download.finish()
+                except ValueError:
+                    self.features = self.classes = self.quantities = None  # corrupted download
+                    raise
+        self.cache.save_features(key, {"features": self.features, "classes": self.classes,
+                                       "quantities": self.quantities},
+                                 meta={"archive_sha1": archive_sha1, "num_samples": self.num_samples})
+        print(f"💾 Cached featurized records as {key}.")
+
+    def _allocate(self, rows):
+        self.features = np.empty((rows, FEATURE_SIZE), dtype=np.float32)
+        self.classes = np.empty(rows, dtype=np.int64)
+        self.quantities = np.empty(rows, dtype=np.int64)
+
+    def ingest(self, batches):
+        """
+        Featurizes ingest batches in parallel (featurize.py), straight into the
+        columns. Stops reading (and downloading) as soon as num_samples
+        records have been processed.
+        """
+        progress = tqdm(total=self.num_samples, desc="Processing Records")
+        try:
+            columns, report = featurize_batches(batches, self.num_samples, progress=progress)
+        finally:
+            progress.close()
+            batches.close()  # releases the HTTP connection / file early
+        self.features, self.classes, self.quantities = columns
+
+        count = len(self.features)
+        print(f"✅ Loaded {count} records ({report.errors} unusable records skipped, "
+              f"{self.ingest_stats.compressed_bytes / 1e6:.1f} MB read) using {len(report.workers)} worker(s):")
+        report.print()
+        if count < self.num_samples:
+            print(f"⚠️ Warning: Requested {self.num_samples} records, but only {count} were processed.")
+            # No backfill, just use what we have
 
     def __len__(self):
-        return len(self.data)
+        return len(self.features)
 
     def __getitem__(self, idx):
+        # idx is one index or a whole batch of them (see make_loader): one gather per column
         # Returns: (Features, Class_Label, Quantity_Label)
-        return self.data[idx]
+        return tuple(column[idx] for column in self.tensors)
+
+class IndexBatchSampler(Sampler):
+    """
+    Yields whole batches as index tensors (a fresh permutation per epoch when shuffling).
+    """
+    def __init__(self, num_rows, batch_size, shuffle=True):
+        self.num_rows = num_rows
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        order = torch.randperm(self.num_rows) if self.shuffle else torch.arange(self.num_rows)
+        return iter(order.split(self.batch_size))
+
+    def __len__(self):
+        return (self.num_rows + self.batch_size - 1) // self.batch_size
+
+def make_loader(dataset, batch_size=BATCH_SIZE, shuffle=True):
+    """
+    Batched index sampling: the sampler yields a batch of indices and the
+    dataset gathers it in one indexing op per column, so there is no
+    per-item __getitem__ / collate work.
+    """
+    return DataLoader(dataset, sampler=IndexBatchSampler(len(dataset), batch_size, shuffle), batch_size=None)
 
 # --- UTILS ---
 
@@ -160,6 +230,72 @@ def get_device():
     print("⚠️ Using CPU (Slow)")
     return torch.device("cpu")
 
+# --- TRAINING LOOP ---
+
+def train_epoch(model, dataloader, optimizer, criterion_class, criterion_qty, device, bf16=False,
+                log_every=LOG_EVERY_STEPS, desc="Training"):
+    """
+    Runs one epoch and returns its metrics (loss, accuracy, qty_err, samples/s).
+
+    Loss, correct predictions and quantity error are accumulated as tensors on
+    the device; nothing is read back (a host/device sync) except every
+    `log_every` steps for the progress bar and once at the end of the epoch.
+    """
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.int64, device=device)
+    qty_err = torch.zeros((), device=device)
+    total = 0
+    steps = 0
+
+    progress_bar = tqdm(dataloader, desc=desc)
+    start = time.perf_counter()
+    for inputs, target_class, target_qty in progress_bar:
+        inputs = inputs.to(device, non_blocking=True)
+        target_class = target_class.to(device, non_blocking=True)
+        target_qty = target_qty.to(device, non_blocking=True).float().unsqueeze(1)
+
+        # Zero Gradients
+        optimizer.zero_grad(set_to_none=True)
+
+        # Forward (bf16 matmuls when enabled; the losses are computed in fp32)
+        with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+            pred_class, pred_qty = model(inputs)
+        pred_class, pred_qty = pred_class.float(), pred_qty.float()
+
+        loss_c = criterion_class(pred_class, target_class)
+        loss_q = criterion_qty(pred_qty, target_qty)
+
+        # Weighted Loss (Classification is primary, Quantity is secondary but important)
+        loss = loss_c + (0.05 * loss_q)
+
+        # Backward
+        loss.backward()
+        optimizer.step()
+
+        # Stats (on device, no sync)
+        with torch.no_grad():
+            running_loss += loss.detach()
+            correct += (pred_class.argmax(1) == target_class).sum()
+            qty_err += torch.abs(pred_qty - target_qty).sum()
+        total += target_class.size(0)
+        steps += 1
+
+        if log_every and steps % log_every == 0:
+            progress_bar.set_postfix({'loss': running_loss.item() / steps, 'acc': correct.item() / total,
+                                      'qty_err': qty_err.item() / total})
+
+    # One sync for the whole epoch (also makes the timing honest on accelerators)
+    loss_sum, correct_sum, qty_err_sum = (value.item() for value in (running_loss, correct, qty_err))
+    elapsed = time.perf_counter() - start
+    progress_bar.close()
+    return {
+        "loss": loss_sum / max(steps, 1),
+        "acc": correct_sum / max(total, 1),
+        "qty_err": qty_err_sum / max(total, 1),
+        "samples": total,
+        "samples_per_s": total / elapsed if elapsed > 0 else 0.0,
+    }
+
 # --- MAIN ---
 
 def train():
@@ -169,7 +305,7 @@ def train():
     
     # 1. Prepare Data
     dataset = BoxClinicalDataset(num_samples=10000) # Start with 10k for speed
-    dataloader = DataLoader(dataset, batch_size=BATCH_SIZE, shuffle=True)
+    dataloader = make_loader(dataset, batch_size=BATCH_SIZE, shuffle=True)
     
     # 2. Initialize Model
     INPUT_SIZE = 10 
@@ -180,59 +316,87 @@ def train():
     criterion_qty = nn.MSELoss()
     
     optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
-    
-    print(f"Starting Training: {EPOCHS} Epochs...")
+
+    bf16 = TRAIN_BF16
+    if bf16 and device.type != "cpu":
+        print(f"⚠️ SENTRIA_TRAIN_BF16 only applies to CPU training. Ignoring it on {device.type}.")
+        bf16 = False
+
+    print(f"Starting Training: {EPOCHS} Epochs{' (bf16 autocast)' if bf16 else ''}...")
     model.train()
     
     # 3. Training Loop
     for epoch in range(EPOCHS):
-        running_loss = 0.0
-        correct = 0
-        total = 0
-        
-        progress_bar = tqdm(dataloader, desc=f"Epoch {epoch+1}/{EPOCHS}")
-        
-        for inputs, target_class, target_qty in progress_bar:
-            inputs = inputs.to(device)
-            target_class = target_class.to(device)
-            target_qty = target_qty.to(device).float().unsqueeze(1)
-            
-            # Zero Gradients
-            optimizer.zero_grad()
-            
-            # Forward
-            pred_class, pred_qty = model(inputs)
-            
-            loss_c = criterion_class(pred_class, target_class)
-            loss_q = criterion_qty(pred_qty, target_qty)
-            
-            # Weighted Loss (Classification is primary, Quantity is secondary but important)
-            loss = loss_c + (0.05 * loss_q) 
-            
-            # Backward
-            loss.backward()
-            optimizer.step()
-            
-            # Stats
-            running_loss += loss.item()
-            _, predicted = torch.max(pred_class.data, 1)
-            total += target_class.size(0)
-            correct += (predicted == target_class).sum().item()
-            
-            progress_bar.set_postfix({'loss': loss.item(), 'acc': correct/total, 'qty_err': torch.mean(torch.abs(pred_qty - target_qty)).item()})
-            
-        epoch_acc = 100 * correct / total
-        print(f"Epoch {epoch+1} Complete. Avg Loss: {running_loss/len(dataloader):.4f} | Accuracy: {epoch_acc:.2f}%")
+        metrics = train_epoch(model, dataloader, optimizer, criterion_class, criterion_qty, device, bf16=bf16,
+                              desc=f"Epoch {epoch+1}/{EPOCHS}")
+        print(f"Epoch {epoch+1} Complete. Avg Loss: {metrics['loss']:.4f} | Accuracy: {100 * metrics['acc']:.2f}% | "
+              f"Qty Err: {metrics['qty_err']:.2f} | {metrics['samples_per_s']:,.0f} samples/s")
         
         # Checkpoint
         if (epoch + 1) % 5 == 0:
             torch.save(model.state_dict(), f"backend/checkpoints/model_epoch_{epoch+1}.pth")
 
     # 4. Save Final Model
-    torch.save(model.state_dict(), "backend/clinical_model_final.pth")
-    print("✅ Training Complete. Model Saved to 'backend/clinical_model_final.pth'")
+    torch.save(model.state_dict(), MODEL_PATH)
+    print(f"✅ Training Complete. Model Saved to '{MODEL_PATH}'")
+
+    # 5. Export Serving Artifacts (float32 + opt-in int8 + torch-free)
+    export_weights_json(model)
+    export_inference_artifact(model)
+    export_inference_artifact(model, QUANTIZED_TORCHSCRIPT_PATH, quantize=True)
+
+# --- EXPORT ---
+
+def export_inference_artifact(model, path=TORCHSCRIPT_PATH, quantize=False):
+    """
+    Writes a traced & frozen, inference-only TorchScript copy of the model.
+    Freezing inlines the weights as constants and drops the (eval-mode no-op)
+    dropout layers, so serve.py can load it without rebuilding ClinicalNetwork.
+    With quantize=True the Linear layers are dynamically quantized to int8 first.
+    """
+    model = model.to("cpu").eval()
+    if quantize:
+        model = quantize_for_inference(model)
+    example = torch.rand(8, 10)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced)
+
+        # Parity Check: the artifact must reproduce the eager outputs
+        eager_class, eager_qty = model(example)
+        frozen_class, frozen_qty = frozen(example)
+        if not (torch.allclose(eager_class, frozen_class, atol=1e-5) and torch.allclose(eager_qty, frozen_qty, atol=1e-5)):
+            raise RuntimeError("TorchScript export does not match eager model outputs")
+
+    frozen.save(path)
+    print(f"🧊 Frozen TorchScript Inference Artifact{' (int8)' if quantize else ''} Saved to '{path}'")
+
+def export_weights_json(model, path=WEIGHTS_JSON_PATH):
+    """
+    Writes the weights as a JSON list ([kernel (in, out), bias] per layer)
+    for the torch-free NumPy engine (SENTRIA_ENGINE=numpy).
+    """
+    state_dict = {name: tensor.detach().cpu().numpy() for name, tensor in model.state_dict().items()}
+    with open(path, "w") as f:
+        json.dump(to_weights_list(state_dict), f)
+    print(f"📦 Torch-Free Weights Saved to '{path}'")
+
+def export_from_checkpoint():
+    """
+    Re-exports the serving artifact from an existing checkpoint without retraining.
+    """
+    model = ClinicalNetwork(10, 50)
+    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
+    export_weights_json(model)
+    export_inference_artifact(model)
+    export_inference_artifact(model, QUANTIZED_TORCHSCRIPT_PATH, quantize=True)
 
 if __name__ == "__main__":
+    if "--export" in sys.argv:
+        export_from_checkpoint()
+        sys.exit(0)
+
     if not os.path.exists("backend/checkpoints"):
         os.makedirs("backend/checkpoints")
     train()
@@ -0,0 +1,162 @@
+"""
+Shared Clinical Feature Vectorizer (train.py + serve.py).
+
+Input layout (10 dims, float32):
+    [0]    Age (normalized, age / 100)
+    [1]    Gender (female = 1.0, male = 0.0, other/unknown = 0.5)
+    [2:9]  Diagnosis embedding (7 dims)
+    [9]    Diagnosis resolved to a known vocabulary term (1.0 / 0.0)
+
+The vocabulary (`data/drug_vocabulary.json`, ~50k names) and the synonym map
+are compiled ONCE into a dict of normalized name -> term ID, so resolving a
+diagnosis is a few O(1) lookups instead of a scan. Unknown terms fall back to
+a stable hash bucket. Each term ID indexes a fixed, seeded embedding table,
+so whole batches are encoded with a single NumPy gather.
+
+Term IDs (and so the embedding rows) depend on the vocabulary's size and
+order: `fingerprint` hashes the contents of both files, so anything cached
+from this vectorizer's output can be keyed on it.
+"""
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+VOCAB_PATH = "data/drug_vocabulary.json"
+SYNONYM_PATH = "data/synonym_map.json"
+
+# Bump whenever the feature layout or encoding changes (cached features are keyed on it)
+FEATURIZER_VERSION = "2"
+
+FEATURE_SIZE = 10
+EMBEDDING_DIM = 7
+HASH_BUCKETS = 4096
+EMBEDDING_SEED = 20240101
+
+_GENDERS = {
+    "female": 1.0, "f": 1.0, "woman": 1.0,
+    "male": 0.0, "m": 0.0, "man": 0.0,
+}
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize(text):
+    return _WHITESPACE.sub(" ", str(text or "").lower()).strip()
+
+def stable_hash(text):
+    # Python's hash() is salted per process; crc32 gives identical buckets in
+    # every worker and in training
+    return zlib.crc32(text.encode("utf-8"))
+
+class ClinicalVectorizer:
+    """
+    Batched patient -> feature matrix encoder with a precomputed vocabulary index.
+    """
+
+    def __init__(self, vocab_path=VOCAB_PATH, synonym_path=SYNONYM_PATH):
+        self.term_ids = {}
+        self.synonyms = {}
+        digest = hashlib.sha1()
+
+        drugs = []
+        if os.path.exists(vocab_path):
+            with open(vocab_path, "rb") as f:
+                raw = f.read()
+            digest.update(raw)
+            vocab = json.loads(raw)
+            drugs = vocab["drugs"] if isinstance(vocab, dict) else vocab
+        else:
+            print(f"⚠️ Vocabulary not found at {vocab_path}. Diagnoses will be hash-encoded only.")
+
+        # 1. Exact names
+        for term_id, drug in enumerate(drugs):
+            self.term_ids.setdefault(normalize(drug), term_id)
+        # 2. First-word aliases (e.g. "metformin" -> "Metformin Hydrochloride 500 Mg ...")
+        for term_id, drug in enumerate(drugs):
+            first_word = normalize(drug).split(" ")[0]
+            if len(first_word) > 3:
+                self.term_ids.setdefault(first_word, term_id)
+
+        # Separator keeps "vocab missing" and "synonyms missing" apart
+        digest.update(b"\0")
+        if os.path.exists(synonym_path):
+            with open(synonym_path, "rb") as f:
+                raw = f.read()
+            digest.update(raw)
+            self.synonyms = {normalize(k): normalize(v) for k, v in json.loads(raw).items()}
+
+        # Content hash of the vocabulary + synonym map (see module docstring)
+        self.fingerprint = digest.hexdigest()[:16]
+
+        self.vocab_size = len(drugs)
+
+        # Row i < vocab_size: known term i. Rows after that: hash buckets for unknown terms.
+        rng = np.random.default_rng(EMBEDDING_SEED)
+        table = rng.standard_normal((self.vocab_size + HASH_BUCKETS, EMBEDDING_DIM)).astype(np.float32)
+        table /= np.linalg.norm(table, axis=1, keepdims=True)
+        self.embeddings = table
+
+        self._resolved = {}
+
+    def resolve(self, diagnosis):
+        """
+        Maps a free-text diagnosis to (embedding row, known_flag). Memoized per distinct string.
+        """
+        cached = self._resolved.get(diagnosis)
+        if cached is not None:
+            return cached
+
+        term = normalize(diagnosis)
+        canonical = self.synonyms.get(term, term)
+
+        term_id = self.term_ids.get(canonical)
+        if term_id is None and canonical:
+            term_id = self.term_ids.get(canonical.split(" ")[0])
+
+        if term_id is not None:
+            resolved = (term_id, 1.0)
+        else:
+            resolved = (self.vocab_size + stable_hash(canonical) % HASH_BUCKETS, 0.0)
+
+        # Bounded memo so adversarial input can't grow it forever
+        if len(self._resolved) < 100000:
+            self._resolved[diagnosis] = resolved
+        return resolved
+
+    def vectorize(self, ages, genders, diagnoses):
+        """
+        Encodes N patients into one (N, FEATURE_SIZE) float32 matrix.
+        """
+        n = len(ages)
+        features = np.empty((n, FEATURE_SIZE), dtype=np.float32)
+        features[:, 0] = np.asarray(ages, dtype=np.float32) / 100.0
+        features[:, 1] = [_GENDERS.get(normalize(gender), 0.5) for gender in genders]
+
+        resolved = [self.resolve(diagnosis) for diagnosis in diagnoses]
+        rows = np.fromiter((row for row, _ in resolved), dtype=np.int64, count=n)
+        features[:, 2:2 + EMBEDDING_DIM] = self.embeddings[rows]
+        features[:, 9] = [known for _, known in resolved]
+        return features
+
+    def vectorize_records(self, records):
+        """
+        Encodes raw dict records ({"age", "gender", "diagnosis", ...}).
+        """
+        return self.vectorize(
+            [float(record.get("age", 40)) for record in records],
+            [record.get("gender", "") for record in records],
+            [record.get("diagnosis", "General") for record in records],
+        )
+
+_vectorizer = None
+
+def get_vectorizer():
+    """
+    Process-wide singleton: the index is built once (before fork, under backend.prefork).
+    """
+    global _vectorizer
+    if _vectorizer is None:
+        _vectorizer = ClinicalVectorizer()
+    return _vectorizer
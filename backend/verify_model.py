@@ -1,17 +1,76 @@
 import torch
-from model import ClinicalNetwork
+from model import ClinicalNetwork, quantize_for_inference
+from numpy_engine import NumpyClinicalNetwork
+from vectorizer import get_vectorizer
+from ingest import iter_local_records
 import numpy as np
+import argparse
+import io
+import itertools
 import os
+import random
+import sys
+import time
 
 MODEL_PATH = "backend/clinical_model_final.pth"
 
-def verify():
+# Int8 Drift Budget (SENTRIA_QUANTIZE=1 serving mode); the flags below override these
+DRIFT_SAMPLES = int(os.getenv("SENTRIA_DRIFT_SAMPLES", "10000"))
+MIN_TOP1_AGREEMENT = float(os.getenv("SENTRIA_DRIFT_MIN_TOP1_AGREEMENT", "0.99"))
+MAX_MEAN_QTY_DRIFT = float(os.getenv("SENTRIA_DRIFT_MAX_MEAN_QTY", "1.0"))
+# Drift is measured on vectorized patient records: this archive if set (same as train.py), else synthetic ones
+TRAINING_DATA_FILE = os.getenv("SENTRIA_TRAINING_DATA_FILE")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sentria model verification")
+    parser.add_argument("--samples", type=int, default=DRIFT_SAMPLES, help="records in the int8 drift probe")
+    parser.add_argument("--min-top1-agreement", type=float, default=MIN_TOP1_AGREEMENT)
+    parser.add_argument("--max-mean-qty-drift", type=float, default=MAX_MEAN_QTY_DRIFT)
+    parser.add_argument("--records", default=TRAINING_DATA_FILE, help="patient archive (.json / .ndjson, optionally .gz)")
+    return parser.parse_args()
+
+def synthetic_records(count, vectorizer, seed=0):
+    """
+    Patient records shaped like the training data: mostly vocabulary terms,
+    some synonyms and some free text that only hashes to a bucket.
+    """
+    rng = random.Random(seed)
+    terms = sorted(vectorizer.term_ids)
+    synonyms = sorted(vectorizer.synonyms) or terms
+    records = []
+    for n in range(count):
+        pick = rng.random()
+        if pick < 0.7:
+            diagnosis = rng.choice(terms)
+        elif pick < 0.85:
+            diagnosis = rng.choice(synonyms)
+        else:
+            diagnosis = f"Unlisted Condition {n}"
+        records.append({"age": rng.randint(1, 95), "gender": rng.choice(["female", "male", "other"]),
+                        "diagnosis": diagnosis})
+    return records
+
+def probe_features(count, records_path=None):
+    """
+    Builds a (count, 10) probe batch with the serving vectorizer, so drift is
+    measured on the inputs the model actually sees.
+    """
+    vectorizer = get_vectorizer()
+    if records_path:
+        records = list(itertools.islice(iter_local_records(records_path), count))
+        print(f"Probe: {len(records)} records from {records_path}")
+    else:
+        records = synthetic_records(count, vectorizer)
+        print(f"Probe: {len(records)} synthetic records (set --records for real ones)")
+    return torch.from_numpy(vectorizer.vectorize_records(records))
+
+def verify(args):
     print("--- MODEL FORENSICS & VERIFICATION ---")
     
     # 1. Check File Existence
     if not os.path.exists(MODEL_PATH):
         print(f"❌ Model file not found at {MODEL_PATH}")
-        return
+        return False
 
     file_size = os.path.getsize(MODEL_PATH)
     print(f"✅ Model File Found: {file_size / 1024:.2f} KB")
@@ -24,7 +83,7 @@ def verify():
         print("✅ Weights Loaded Successfully")
     except Exception as e:
         print(f"❌ Failed to load weights: {e}")
-        return
+        return False
 
     # 3. Analyze Weights (The "Fugazi" Check)
     print("\n--- WEIGHT ANALYSIS ---")
@@ -92,5 +151,99 @@ def verify():
     else:
         print("⚠️ Prediction is close to random guessing.")
 
+    # 6. Torch-Free Engine Parity (SENTRIA_ENGINE=numpy)
+    verify_numpy_engine(model)
+
+    # 7. Quantization Drift Check (int8 vs float32)
+    return verify_quantization(model, probe_features(args.samples, args.records),
+                               args.min_top1_agreement, args.max_mean_qty_drift)
+
+def verify_numpy_engine(model):
+    """
+    The NumPy engine must reproduce the torch outputs from the same checkpoint.
+    """
+    print("\n--- NUMPY ENGINE PARITY ---")
+    engine = NumpyClinicalNetwork.load(MODEL_PATH)
+
+    torch.manual_seed(1)
+    probe = torch.rand(1000, 10)
+    with torch.inference_mode():
+        t_class, t_qty = model.to("cpu").eval()(probe)
+    n_class, n_qty = engine(probe.numpy())
+
+    class_diff = np.abs(t_class.numpy() - n_class).max()
+    qty_diff = np.abs(t_qty.numpy() - n_qty).max()
+    top1_match = (t_class.argmax(1).numpy() == n_class.argmax(1)).all()
+    print(f"Max Logit Diff: {class_diff:.2e} | Max Quantity Diff: {qty_diff:.2e}")
+
+    if top1_match and class_diff < 1e-4 and qty_diff < 1e-4:
+        print("✅ NumPy engine matches torch outputs.")
+    else:
+        print("❌ NumPy engine diverges from torch outputs.")
+
+def serialized_size(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def time_forward(model, inputs, repeats=200):
+    with torch.inference_mode():
+        for _ in range(10):
+            model(inputs)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(inputs)
+    return (time.perf_counter() - start) / repeats
+
+def verify_quantization(model, probe, min_top1_agreement=MIN_TOP1_AGREEMENT, max_mean_qty_drift=MAX_MEAN_QTY_DRIFT):
+    """
+    Compares the dynamically-quantized (int8) model against the float model
+    on a probe batch: top-1 drug class agreement, quantity drift, size and
+    CPU latency. Returns True if the drift is within budget.
+    """
+    print("\n--- INT8 QUANTIZATION DRIFT CHECK ---")
+    float_model = model.to("cpu").eval()
+    quantized = quantize_for_inference(float_model)
+
+    with torch.inference_mode():
+        f_class, f_qty = float_model(probe)
+        q_class, q_qty = quantized(probe)
+
+    f_conf, f_idx = torch.max(torch.softmax(f_class, dim=1), 1)
+    q_conf, q_idx = torch.max(torch.softmax(q_class, dim=1), 1)
+
+    top1_agreement = (f_idx == q_idx).float().mean().item()
+    qty_drift = torch.abs(f_qty - q_qty)
+    served_qty_agreement = (f_qty.int() == q_qty.int()).float().mean().item()
+    conf_drift = torch.abs(f_conf - q_conf).max().item()
+
+    print(f"Samples: {len(probe)}")
+    print(f"Top-1 Class Agreement: {100 * top1_agreement:.2f}%")
+    print(f"Quantity Drift: mean {qty_drift.mean().item():.4f} | max {qty_drift.max().item():.4f} | served (int) agreement {100 * served_qty_agreement:.2f}%")
+    print(f"Max Confidence Drift: {conf_drift:.5f}")
+
+    # Speed & Memory Gain
+    float_size, quant_size = serialized_size(float_model), serialized_size(quantized)
+    print(f"Weights Size: float32 {float_size / 1024:.1f} KB -> int8 {quant_size / 1024:.1f} KB ({float_size / quant_size:.2f}x smaller)")
+    speedups = []
+    for batch in (1, 256):
+        inputs = probe[:batch]
+        f_time, q_time = time_forward(float_model, inputs), time_forward(quantized, inputs)
+        speedups.append(f_time / q_time)
+        print(f"Latency (batch {batch}): float32 {f_time * 1e6:.1f} us -> int8 {q_time * 1e6:.1f} us ({f_time / q_time:.2f}x)")
+
+    within_budget = top1_agreement >= min_top1_agreement and qty_drift.mean().item() <= max_mean_qty_drift
+    if within_budget:
+        print(f"✅ Int8 drift within budget (>= {100 * min_top1_agreement:.2f}% top-1, <= {max_mean_qty_drift} mean qty).")
+    else:
+        print(f"⚠️ Int8 drift exceeds budget (>= {100 * min_top1_agreement:.2f}% top-1, <= {max_mean_qty_drift} mean qty). Keep serving the float32 model.")
+
+    # Small layers can be dominated by the on-the-fly activation quantization cost
+    if min(speedups) < 1.0:
+        print(f"⚠️ Int8 is slower than float32 on this CPU for at least one batch size. Only enable SENTRIA_QUANTIZE=1 for the memory saving.")
+    else:
+        print(f"✅ Int8 is faster on this CPU ({min(speedups):.2f}x or better).")
+    return within_budget
+
 if __name__ == "__main__":
-    verify()
+    sys.exit(0 if verify(parse_args()) else 1)
@@ -0,0 +1,100 @@
+import requests
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# Run from the repo root with a trained model in place:
+#     python backend/verify_prefork.py
+WORKERS = int(os.getenv("SENTRIA_VERIFY_WORKERS", "3"))
+PORT = int(os.getenv("SENTRIA_VERIFY_PORT", "8765"))
+BASE_URL = f"http://127.0.0.1:{PORT}"
+STARTUP_TIMEOUT = 120  # seconds
+MAX_HEALTH_CALLS = 200  # per check, to reach every worker
+
+def worker_versions():
+    """
+    Calls /health on fresh connections until every worker has answered.
+    Returns {pid: model_version}.
+    """
+    versions = {}
+    for _ in range(MAX_HEALTH_CALLS):
+        r = requests.get(f"{BASE_URL}/health", headers={"Connection": "close"}, timeout=10)
+        status = r.json()
+        versions[status["pid"]] = status["model_version"]
+        if len(versions) == WORKERS:
+            break
+    return versions
+
+def wait_until_up(server):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            if len(worker_versions()) == WORKERS:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+def verify_reload_reaches_every_worker():
+    print(f"--- PRE-FORK HOT RELOAD ({WORKERS} workers) ---")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "backend.prefork", "--workers", str(WORKERS), "--port", str(PORT), "--log-level", "warning"],
+        env={**os.environ, "SENTRIA_MODEL_WATCH_INTERVAL": "0"},
+    )
+    try:
+        # 1. Every worker starts on the master's preloaded model
+        if not wait_until_up(server):
+            print("❌ Pre-fork server did not come up with every worker")
+            return False
+        before = worker_versions()
+        print(f"✅ Workers up: {before}")
+        if len(set(before.values())) != 1:
+            print("❌ Workers started on different model versions")
+            return False
+        expected = next(iter(before.values())) + 1
+
+        # 2. Reload through ONE worker
+        r = requests.post(f"{BASE_URL}/admin/model/reload", timeout=180)
+        if r.status_code != 200:
+            print(f"❌ Reload Failed: {r.status_code} {r.text}")
+            return False
+        print(f"✅ Reload answered by one worker: v{r.json()['model_version']}")
+
+        # 3. Every worker must now serve the new model (the others reload in parallel)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        after = worker_versions()
+        while any(version != expected for version in after.values()) and time.monotonic() < deadline:
+            time.sleep(0.5)
+            after = worker_versions()
+        if len(after) != WORKERS or any(version != expected for version in after.values()):
+            print(f"❌ Not every worker reloaded (expected v{expected}): {after}")
+            return False
+        print(f"✅ Every worker on v{expected}: {after}")
+
+        # 4. A restarted worker forks from the master, which must have reloaded too
+        victim = next(iter(after))
+        os.kill(victim, signal.SIGKILL)
+        time.sleep(2.0)
+        if not wait_until_up(server):
+            print("❌ Worker was not restarted")
+            return False
+        restarted = worker_versions()
+        if victim in restarted or any(version != expected for version in restarted.values()):
+            print(f"❌ Restarted worker is not on v{expected}: {restarted}")
+            return False
+        print(f"✅ Restarted worker forked on v{expected}: {restarted}")
+        return True
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+if __name__ == "__main__":
+    sys.exit(0 if verify_reload_reaches_every_worker() else 1)